@@ -0,0 +1,254 @@
+import os
+import sys
+import uuid
+import shutil
+import time
+import argparse
+import datetime
+import tempfile
+from copy import copy
+import openpyxl
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from seace_standin import Dataset
+
+# Benchmark of the streaming Excel writer (main.data_to_excel) against the
+# previous pd.ExcelWriter + load_workbook + per-cell styling path, which is kept
+# below verbatim as the baseline. Both outputs are compared style by style, and
+# user fills are checked to follow their Nomenclatura.
+
+#
+# Previous implementation
+#
+
+def legacy_format_table(wb, sheetname, df, display_name, output_file, temp_index_array=None):
+    # Define styles
+    style = openpyxl.worksheet.table.TableStyleInfo(name="TableStyleMedium9", showFirstColumn=False,
+                           showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+    alignment = openpyxl.styles.Alignment(wrap_text=True, vertical='top', horizontal='left')
+    right_alignment = openpyxl.styles.Alignment(wrap_text=True, vertical='top', horizontal='right')
+    font = openpyxl.styles.Font(name="Aptos Narrow", size=10)
+
+    width_dict = {
+        "Descripción de Objeto": 60,
+        "Nombre o Sigla de la Entidad": 40,
+        "Valor Referencial / Valor Estimado": 30
+    }
+
+    # Apply the styles
+    table = openpyxl.worksheet.table.Table(
+        displayName=display_name,
+        ref=f'A1:{openpyxl.utils.get_column_letter(df.shape[1])}{len(df)+1}'
+    )
+    table.tableStyleInfo = style
+    wb[sheetname].add_table(table)
+
+    # Set column widths based on column names
+    for idx, col_name in enumerate(df.columns, start=1):
+        col_letter = openpyxl.utils.get_column_letter(idx)
+        width = width_dict.get(col_name, 25)
+        wb[sheetname].column_dimensions[col_letter].width = width
+
+    # Determine target column index for "Valor Referencial / Valor Estimado"
+    try:
+        target_index = list(df.columns).index("Valor Referencial / Valor Estimado") + 1
+    except ValueError:
+        target_index = None
+
+    # Load the previous workbook if it exists and the sheetname is available
+    if os.path.exists(output_file):
+        old_wb = openpyxl.load_workbook(output_file)
+        if sheetname in old_wb.sheetnames:
+            old_sheet = old_wb[sheetname]
+        else:
+            old_sheet = None
+    else:
+        old_sheet = None
+
+    # Apply alignment to all cells in the table
+    for new_row_idx, row in enumerate(
+            wb[sheetname].iter_rows(min_row=1, max_row=len(df)+1, min_col=1, max_col=df.shape[1]),
+            start=1):
+        if new_row_idx == 1:
+            for cell in row:
+                cell.font = font
+                cell.alignment = alignment
+            continue
+        old_row_idx = temp_index_array[new_row_idx - 2] + 1 if temp_index_array is not None else new_row_idx
+        for cell in row:
+            col_letter = openpyxl.utils.get_column_letter(cell.column)
+            # Copy fill style from the old workbook if the sheet exists and the cell has a fill style
+            if old_sheet is not None:
+                old_cell = old_sheet[f'{col_letter}{old_row_idx}']
+                if old_cell.fill and old_cell.fill.fill_type is not None:
+                    cell.fill = copy(old_cell.fill)
+            # Apply font and alignment
+            cell.font = font
+            if target_index and cell.column == target_index:
+                cell.alignment = right_alignment
+            else:
+                cell.alignment = alignment
+
+    # Set row height to auto
+    for row_num in range(2, len(df) + 2):
+        wb[sheetname].row_dimensions[row_num].height = 90
+
+def legacy_data_to_excel(keyword_dfs, output_file, tmp_dir):
+    filepath = f"{tmp_dir}/{uuid.uuid4()}.xlsx"
+    temp_indexes = {}
+    # Export all DataFrames to an Excel file with each on a separate sheet.
+    with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
+        for keyword, df_kw in keyword_dfs.items():
+            # Add a temporary index column to preserve the original row positions
+            df_kw['temp_index'] = range(1, len(df_kw) + 1)
+
+            # Sort the DataFrame by 'Fecha y Hora de Publicacion' in descending order
+            df_kw['valor_datetime'] = pd.to_datetime(
+                df_kw['Fecha y Hora de Publicacion'],
+                format='%d/%m/%Y %H:%M'
+            )
+            df_kw.sort_values(by='valor_datetime', ascending=False, inplace=True)
+            df_kw.drop('valor_datetime', axis=1, inplace=True)
+
+            # Extract the temporary index as an array and then remove the column
+            temp_indexes[keyword] = df_kw['temp_index'].to_numpy()
+            df_kw.drop(columns=['temp_index'], inplace=True)
+
+            df_kw.to_excel(writer, sheet_name=keyword.capitalize(), index=False)
+
+    # Format table
+    wb = openpyxl.load_workbook(filename = filepath)
+    for keyword, df_kw in keyword_dfs.items():
+        # Retrieve the temp index array for this sheet, if available
+        temp_index_array = temp_indexes.get(keyword, None)
+
+        legacy_format_table(wb, keyword.capitalize(), df_kw, keyword.replace(" ", "").capitalize(), output_file, temp_index_array)
+    wb.save(output_file)
+
+#
+# Benchmark
+#
+
+def sample_sheets(rows, seed=0):
+    dataset = Dataset(seed)
+    tenders = []
+    day = datetime.date(2024, 1, 1)
+    while len(tenders) < rows:
+        tenders += dataset.day(day)
+        day += datetime.timedelta(days=1)
+    df = pd.DataFrame([
+        [t["entity"], t["published"], t["nomenclatura"], None, t["objeto"], t["descripcion"], t["valor"], "Soles", "3"]
+        for t in tenders[:rows]
+    ], columns=main.REQUIRED_HEADER[1:])
+    sheets = {main.MAIN_SHEET_NAME: df}
+    for keyword in main.KEYWORDS:
+        sheets[keyword] = df[df["Descripción de Objeto"].str.contains(keyword, case=False, na=False)]
+    return sheets
+
+def highlight_previous(path, every=7):
+    # Mark some cells the way users do in the OneDrive workbook
+    fill = openpyxl.styles.PatternFill(fill_type="solid", start_color="FFFF00", end_color="FFFF00")
+    wb = openpyxl.load_workbook(path)
+    for ws in wb.worksheets:
+        for row in ws.iter_rows(min_row=2):
+            if row[0].row % every == 0:
+                for cell in row:
+                    cell.fill = copy(fill)
+    wb.save(path)
+
+def copy_sheets(sheets):
+    return {k: v.copy() for k, v in sheets.items()}
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def cell_style(cell):
+    # Fills are left out: the previous path carried them over by row position,
+    # they are checked by Nomenclatura in lost_markings instead
+    return (
+        cell.value,
+        cell.font.name, cell.font.sz, cell.font.b,
+        cell.alignment.horizontal, cell.alignment.vertical, cell.alignment.wrap_text,
+        cell.border.left.style, cell.border.right.style, cell.border.top.style, cell.border.bottom.style,
+        cell.number_format,
+    )
+
+def lost_markings(before_path, after_path):
+    # Markings of the previous workbook that did not follow their Nomenclatura
+    markings, before = main.extract_markings(before_path)
+    _, after = main.extract_markings(after_path)
+    lost = 0
+    for sheet, rows in before.items():
+        for nomenclatura, columns in rows.items():
+            for column, marking in columns.items():
+                carried = after.get(sheet, {}).get(nomenclatura, {}).get(column)
+                if carried is None:
+                    lost += 1
+    return lost
+
+def compare(legacy_path, streamed_path):
+    # Returns a list of differences in values, styles, dimensions and tables
+    differences = []
+    legacy_wb = openpyxl.load_workbook(legacy_path)
+    streamed_wb = openpyxl.load_workbook(streamed_path)
+    if legacy_wb.sheetnames != streamed_wb.sheetnames:
+        return [f"sheets {legacy_wb.sheetnames} != {streamed_wb.sheetnames}"]
+    for name in legacy_wb.sheetnames:
+        a, b = legacy_wb[name], streamed_wb[name]
+        if (a.max_row, a.max_column) != (b.max_row, b.max_column):
+            differences.append(f"{name}: size {(a.max_row, a.max_column)} != {(b.max_row, b.max_column)}")
+            continue
+        for row_a, row_b in zip(a.iter_rows(), b.iter_rows()):
+            for cell_a, cell_b in zip(row_a, row_b):
+                if cell_style(cell_a) != cell_style(cell_b):
+                    differences.append(f"{name}!{cell_a.coordinate}: {cell_style(cell_a)} != {cell_style(cell_b)}")
+        for idx in range(1, a.max_row + 1):
+            if a.row_dimensions[idx].height != b.row_dimensions[idx].height:
+                differences.append(f"{name}: row {idx} height {a.row_dimensions[idx].height} != {b.row_dimensions[idx].height}")
+        for idx in range(1, a.max_column + 1):
+            letter = openpyxl.utils.get_column_letter(idx)
+            if a.column_dimensions[letter].width != b.column_dimensions[letter].width:
+                differences.append(f"{name}: column {letter} width differs")
+        tables_a = {t.displayName: (t.ref, t.tableStyleInfo.name, [c.name for c in t.tableColumns]) for t in a.tables.values()}
+        tables_b = {t.displayName: (t.ref, t.tableStyleInfo.name, [c.name for c in t.tableColumns]) for t in b.tables.values()}
+        if tables_a != tables_b:
+            differences.append(f"{name}: tables {tables_a} != {tables_b}")
+    return differences
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Streaming Excel writer benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 5000, 20000])
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    print(f"{'rows':>8} {'legacy s':>10} {'streamed s':>11} {'speedup':>8} {'lost marks':>11}  differences")
+    for rows in args.rows:
+        sheets = sample_sheets(rows)
+        legacy_path = f"{tmp_dir}/legacy_{rows}.xlsx"
+        streamed_path = f"{tmp_dir}/streamed_{rows}.xlsx"
+
+        # First run creates the workbooks, the second one carries the fills over
+        legacy_data_to_excel(copy_sheets(sheets), legacy_path, tmp_dir)
+        highlight_previous(legacy_path)
+        main.data_to_excel(copy_sheets(sheets), streamed_path)
+        highlight_previous(streamed_path)
+
+        before_path = f"{tmp_dir}/before_{rows}.xlsx"
+        shutil.copy(streamed_path, before_path)
+
+        legacy = timed(legacy_data_to_excel, copy_sheets(sheets), legacy_path, tmp_dir)
+        streamed = timed(main.data_to_excel, copy_sheets(sheets), streamed_path)
+        differences = compare(legacy_path, streamed_path)
+        lost = lost_markings(before_path, streamed_path)
+        print(f"{rows:>8} {legacy:>10.2f} {streamed:>11.2f} {legacy / streamed:>7.1f}x {lost:>11}  {len(differences)}")
+        for difference in differences[:10]:
+            print(f"    {difference}")
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import signal
+import socket
+import argparse
+import datetime
+import resource
+import tempfile
+import subprocess
+import urllib.request
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from seace_standin import PATH, http_templates
+
+# End-to-end benchmark of a full run (vidrios plus four years of obras, store,
+# filters and workbooks) against the local stand-in instead of the portal.
+# The stand-in runs in its own process so it takes no CPU or memory from the
+# measured one, and main is imported once SEACE_URL and DATA_DIR point at it
+# and at a scratch directory. Results can be saved and compared with a
+# previous run:
+#
+#   python bench/harvest_bench.py --save baseline.json
+#   python bench/harvest_bench.py --baseline baseline.json
+#
+# FETCH_ENGINE=browser needs Chromium, the http engine only needs the
+# Playwright package. --chromium runs the browser engine with a Chromium
+# binary installed outside Playwright:
+#
+#   FETCH_ENGINE=browser python bench/harvest_bench.py --chromium /usr/bin/chromium
+
+METRICS = [
+    ("windows", "windows", "{:.0f}"),
+    ("rows", "rows", "{:.0f}"),
+    ("harvest_s", "harvest s", "{:.2f}"),
+    ("windows_per_s", "windows/s", "{:.1f}"),
+    ("rows_per_s", "rows/s", "{:.0f}"),
+    ("truncated_ratio", "truncated", "{:.1%}"),
+    ("excel_s", "excel s", "{:.2f}"),
+    ("publish_s", "publish s", "{:.2f}"),
+    ("peak_rss_mb", "peak RSS MB", "{:.0f}"),
+    ("rss_growth_mb", "RSS growth MB", "{:.0f}"),
+]
+
+class Counters:
+    def __init__(self):
+        self.windows = 0
+        self.rows = 0
+        self.truncated = 0
+        self.excel = 0.0
+        self.publish = 0.0
+
+def counted_get_data(main, get_data, counters):
+    # Counts the windows the portal answered, after retries and hedges
+    async def wrapper(pool, year, start_date, end_date, opts):
+        fetch = get_data or (main.get_data_obras if opts["mode"] == "obras" else main.get_data_vidrios)
+        df = await fetch(pool, year, start_date, end_date, opts)
+        counters.windows += 1
+        counters.rows += len(df)
+        if len(df) >= main.LIMIT_QUERY:
+            counters.truncated += 1
+        return df
+    return wrapper
+
+def timed(function, counters, name):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            setattr(counters, name, getattr(counters, name) + time.perf_counter() - start)
+    return wrapper
+
+async def timed_jobs(jobs, counters):
+    async for job in jobs:
+        yield partial(timed(job, counters, "publish"))
+
+async def harvest(main, current_date, counters, chromium=None):
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as p:
+        if main.FETCH_ENGINE == "browser" and chromium:
+            lean = main.LeanBrowser()
+            browser = await p.chromium.launch(headless=True, executable_path=chromium, args=lean.launch_args())
+        elif main.FETCH_ENGINE == "browser":
+            browser, lean = await main.launch_browser(p)
+        else:
+            browser, lean = None, main.LeanBrowser(enabled=False)
+        harvester = main.Harvester(p, browser, lean)
+        harvester.get_data = counted_get_data(main, harvester.get_data, counters)
+        journal = main.RunJournal(main.DB_FILE, current_date)
+
+        start = time.perf_counter()
+        await main.run_pipeline(timed_jobs(harvester.jobs(current_date, journal), counters))
+        elapsed = time.perf_counter() - start
+        journal.finish()
+
+        await harvester.close()
+        if browser is not None:
+            await browser.close()
+    harvester.retrier.report()
+    main.print_step_latencies()
+    return elapsed
+
+def start_server(args):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "seace_standin.py"),
+        "--port", str(port), "--seed", str(args.seed), "--rows-per-day", str(args.rows_per_day),
+        "--latency", str(args.latency), "--failure-rate", str(args.failure_rate),
+    ])
+    url = f"http://127.0.0.1:{port}{PATH}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url).close()
+            return server, url
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("The stand-in did not start")
+
+def run_bench(args):
+    server, url = start_server(args)
+    data_dir = tempfile.mkdtemp(prefix="harvest-bench-")
+    os.environ.update({"SEACE_URL": url, "DATA_DIR": data_dir, "INCREMENTAL": "no"})
+    os.environ.setdefault("FETCH_ENGINE", "http")
+
+    import main
+
+    os.makedirs(f"{main.DRIVE_DIR}/{main.EXPORT_DIR}", exist_ok=True)
+    if main.FETCH_ENGINE == "http":
+        for mode, template in http_templates(url).items():
+            with open(main.http_template_path(mode), "w") as f:
+                json.dump(template, f)
+
+    counters = Counters()
+    main.data_to_excel = timed(main.data_to_excel, counters, "excel")
+    current_date = datetime.date.fromisoformat(args.date)
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        elapsed = asyncio.run(harvest(main, current_date, counters, args.chromium))
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        "engine": main.FETCH_ENGINE,
+        "windows": counters.windows,
+        "rows": counters.rows,
+        "harvest_s": elapsed,
+        "windows_per_s": counters.windows / elapsed,
+        "rows_per_s": counters.rows / elapsed,
+        "truncated_ratio": counters.truncated / max(counters.windows, 1),
+        "excel_s": counters.excel,
+        "publish_s": counters.publish,
+        "peak_rss_mb": peak_rss / 1e3,
+        "rss_growth_mb": (peak_rss - baseline_rss) / 1e3,
+    }
+
+def print_results(result, baseline=None):
+    print(f"{'metric':<14} {'result':>10}" + (f" {'baseline':>10} {'change':>8}" if baseline else ""))
+    for key, name, fmt in METRICS:
+        line = f"{name:<14} {fmt.format(result[key]):>10}"
+        if baseline:
+            change = f"{result[key] / baseline[key] - 1:+.0%}" if baseline.get(key) else "-"
+            line += f" {fmt.format(baseline.get(key, 0)):>10} {change:>8}"
+        print(line)
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="End-to-end harvest benchmark against the SEACE stand-in")
+    parser.add_argument("--date", default="2026-10-17", help="current date of the simulated run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows-per-day", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds added to every POST")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of searches and exports failing with HTTP 500")
+    parser.add_argument("--chromium", metavar="PATH", help="Chromium binary for FETCH_ENGINE=browser instead of Playwright's")
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with results saved by --save")
+    args = parser.parse_args()
+
+    result = run_bench(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(result, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({**result, "args": vars(args)}, f, indent=2)
+
+if __name__ == "__main__":
+    main_bench()
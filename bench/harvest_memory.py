@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import datetime
+import resource
+import tracemalloc
+import subprocess
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from seace_standin import Dataset, LIMIT_EXPORT
+
+# Memory benchmark of four years of obras held in memory at once: the previous
+# concat-per-bisection-level path with object columns (kept below verbatim as
+# the baseline) against main.ChunkAccumulator with compact dtypes. Every
+# variant runs in its own process so the growth of ru_maxrss is its own.
+
+#
+# Previous implementation
+#
+
+async def legacy_query_data_recursive(get_data, pool, year, start_date, end_date, opts):
+    # Ensure the date range is valid
+    if start_date > end_date:
+        return pd.DataFrame()
+
+    # Query data between start_date and end_date
+    df = await get_data(pool, year, start_date, end_date, opts)
+
+    if len(df) < main.LIMIT_QUERY or start_date == end_date:
+        return df
+
+    # Calculate a midpoint date within the range.
+    delta_days = (end_date - start_date).days
+    mid_date = start_date + datetime.timedelta(days=delta_days // 2)
+
+    # To avoid potential infinite recursion if the split doesn't reduce the range,
+    # make sure the midpoint is strictly before the end_date.
+    if mid_date >= end_date:
+        return df
+
+    # Recursively query the two halves of the date range at the same time.
+    left_df, right_df = await asyncio.gather(
+        legacy_query_data_recursive(get_data, pool, year, start_date, mid_date, opts),
+        legacy_query_data_recursive(get_data, pool, year, mid_date + datetime.timedelta(days=1), end_date, opts),
+    )
+
+    # Concatenate the results from the two halves.
+    return pd.concat([left_df, right_df], ignore_index=True)
+
+async def legacy_year(get_data, year, windows):
+    results = await asyncio.gather(*(
+        legacy_query_data_recursive(get_data, None, year, start_date, end_date, {"mode": "obras"})
+        for start_date, end_date in windows
+    ))
+    return pd.concat(results, ignore_index=True)
+
+async def accumulated_year(get_data, year, windows):
+    async def query(start_date, end_date):
+        return await main.general_query_data_recursive(get_data, None, year, start_date, end_date, {"mode": "obras"})
+    accumulator = main.ChunkAccumulator()
+    accumulator.extend(await main.gather_windows(query, windows))
+    return accumulator.materialize()
+
+#
+# Benchmark
+#
+
+def fresh(text):
+    # A new string object, as every download parses its own copies
+    return text.encode().decode() if isinstance(text, str) else text
+
+def export_frame(tenders):
+    # What read_export returns for a window, without the xlsx round trip
+    rows = [
+        [fresh(value) for value in (n, t["entity"], t["published"], t["nomenclatura"], None, t["objeto"], t["descripcion"], t["valor"], "Soles", "3")]
+        for n, t in enumerate(tenders[:LIMIT_EXPORT], start=1)
+    ]
+    return pd.DataFrame(rows, columns=main.REQUIRED_HEADER).astype({c: main.EXPORT_DTYPES[c] for c in main.REQUIRED_HEADER})
+
+def year_windows(year, current_date, days):
+    windows = []
+    for start_date, end_date, _ in main.obras_spans(year, current_date):
+        windows += main.chunk_windows(start_date, end_date, days)
+    return windows
+
+def run_variant(variant, rows_per_day, days):
+    dataset = Dataset(seed=0, rows_per_day=rows_per_day)
+    current_date = datetime.date(2026, 10, 17)
+
+    async def get_data(pool, year, start_date, end_date, opts):
+        return export_frame(dataset.search(int(year), "Obra", start_date, end_date, None))
+
+    # Generate the portal contents up front so they are not part of the measurement
+    for year in range(current_date.year - 3, current_date.year + 1):
+        dataset.search(year, None, datetime.date(year, 1, 1), datetime.date(year, 12, 31), None)
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    query_year = legacy_year if variant == "legacy" else accumulated_year
+    tracemalloc.start()
+    years = {
+        year: asyncio.run(query_year(get_data, str(year), year_windows(year, current_date, days)))
+        for year in range(current_date.year - 3, current_date.year + 1)
+    }
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "variant": variant,
+        "rows": sum(len(df) for df in years.values()),
+        "frames_mb": sum(df.memory_usage(deep=True).sum() for df in years.values()) / 1e6,
+        "retained_mb": current / 1e6,
+        "peak_mb": peak / 1e6,
+        "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1e3,
+    }
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Harvest memory benchmark")
+    parser.add_argument("--rows-per-day", type=int, default=120)
+    parser.add_argument("--days", type=int, default=15, help="planned window size")
+    parser.add_argument("--variant", choices=["legacy", "accumulator"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.rows_per_day, args.days)))
+        return
+
+    results = []
+    for variant in ["legacy", "accumulator"]:
+        output = subprocess.run(
+            [sys.executable, __file__, "--variant", variant, "--rows-per-day", str(args.rows_per_day), "--days", str(args.days)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'variant':<12} {'rows':>8} {'frames MB':>10} {'retained MB':>12} {'peak MB':>9} {'RSS growth MB':>14}")
+    for r in results:
+        print(
+            f"{r['variant']:<12} {r['rows']:>8} {r['frames_mb']:>10.1f} {r['retained_mb']:>12.1f} "
+            f"{r['peak_mb']:>9.1f} {r['rss_growth_mb']:>14.1f}"
+        )
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="merge-delta-"))
+
+import main
+from excel_writer import sample_sheets
+
+# Publishes a workbook, then the same rows plus one day's delta (new and changed
+# rows) and checks that MergeIndex counts exactly the delta: rows left as they
+# were must count as unchanged next to new ones. Then the changes are reverted
+# by a run killed while writing the workbook, and the same run again must still
+# bring them to the file. Exits 1 on a failed check.
+
+def publish(merge_index, path, df):
+    merge_index.counts = {key: 0 for key in merge_index.counts}
+    start = time.perf_counter()
+    main.publish_workbook({main.MAIN_SHEET_NAME: df.copy()}, path, merge_index)
+    return time.perf_counter() - start, dict(merge_index.counts)
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Merge index delta check")
+    parser.add_argument("--rows", type=int, default=5000, help="rows already published")
+    parser.add_argument("--new", type=int, default=40, help="rows added by the day")
+    parser.add_argument("--changed", type=int, default=10, help="published rows changed by the day")
+    args = parser.parse_args()
+
+    df = sample_sheets(args.rows + args.new)[main.MAIN_SHEET_NAME]
+    path = f"{main.DRIVE_DIR}/merge_delta.xlsx"
+    os.makedirs(main.DRIVE_DIR, exist_ok=True)
+    merge_index = main.MergeIndex(main.DB_FILE)
+
+    seconds, _ = publish(merge_index, path, df.iloc[:args.rows])
+    print(f"first publish: {args.rows} rows in {seconds:.2f}s")
+
+    day = df.copy()
+    day.iloc[:args.changed, day.columns.get_loc("Moneda")] = "Dolares"
+    seconds, counts = publish(merge_index, path, day)
+    expected = {"inserted": args.new, "updated": args.changed, "unchanged": args.rows - args.changed}
+    print(f"delta publish: {counts} in {seconds:.2f}s")
+    if counts != expected:
+        print(f"expected {expected}")
+        sys.exit(1)
+
+    def killed(keyword_dfs, output_file):
+        raise KeyboardInterrupt("killed while writing the workbook")
+
+    write = main.data_to_excel
+    main.data_to_excel = killed
+    try:
+        publish(merge_index, path, df)
+    except KeyboardInterrupt:
+        pass
+    main.data_to_excel = write
+    publish(main.MergeIndex(main.DB_FILE), path, df)
+    stale = int((pd.read_excel(path)["Moneda"] == "Dolares").sum())
+    print(f"after an interrupted write: {stale} changed rows missing from the workbook")
+    if stale:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_bench()
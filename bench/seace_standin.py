@@ -0,0 +1,516 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import datetime
+import threading
+from io import BytesIO
+from html import escape
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qsl, urlsplit
+import openpyxl
+
+# Local stand-in for the SEACE public search (buscadorPublico.xhtml).
+# It speaks the same JSF form protocol as the portal: a ViewState per view,
+# PrimeFaces partial requests for the search and a plain POST for the export.
+# The page carries the element IDs main.py drives, so both fetch engines run
+# against it, and latency and failures can be injected into every POST.
+
+PATH = "/seacebus-uiwd-pub/buscadorPublico/buscadorPublico.xhtml"
+FORM = "tbBuscador:idFormBuscarProceso"
+OBJECT_FIELD = f"{FORM}:j_idt39_input"
+LIMIT_EXPORT = 499
+NO_DATA_TEXT = "No se encontraron Datos"
+
+EXPORT_HEADER = [
+    "N°",
+    "Nombre o Sigla de la Entidad",
+    "Fecha y Hora de Publicacion",
+    "Nomenclatura",
+    "Reiniciado Desde",
+    "Objeto de Contratación",
+    "Descripción de Objeto",
+    "VR / VE / Cuantía de la contratación",
+    "Moneda",
+    "Versión SEACE",
+]
+
+ENTITIES = [
+    "MUNICIPALIDAD PROVINCIAL DE AREQUIPA",
+    "MUNICIPALIDAD DISTRITAL DE MIRAFLORES",
+    "GOBIERNO REGIONAL DE CUSCO",
+    "GOBIERNO REGIONAL DE PIURA",
+    "UNIVERSIDAD NACIONAL MAYOR DE SAN MARCOS",
+    "UNIVERSIDAD NACIONAL DE INGENIERIA",
+    "SEGURO SOCIAL DE SALUD",
+    "PROGRAMA NACIONAL DE INFRAESTRUCTURA EDUCATIVA",
+    "MINISTERIO DE SALUD",
+    "MINISTERIO DE TRANSPORTES Y COMUNICACIONES",
+    "PROVIAS DESCENTRALIZADO",
+    "MUNICIPALIDAD PROVINCIAL DE TRUJILLO",
+]
+OBJECTS = [("Obra", 35), ("Bien", 30), ("Servicio", 30), ("Consultoría de Obra", 5)]
+WORKS = [
+    "MEJORAMIENTO DEL SERVICIO DE",
+    "CONSTRUCCION DE",
+    "ADQUISICION DE VENTANAS PARA",
+    "INSTALACION DE MAMPARAS DE VIDRIO EN",
+    "SUMINISTRO E INSTALACION DE MURO CORTINA EN",
+    "REHABILITACION DE",
+    "AMPLIACION DE",
+]
+PLACES = [
+    "LA UNIVERSIDAD NACIONAL DE SAN AGUSTIN",
+    "EL HOSPITAL REGIONAL DE ICA",
+    "EL COLEGIO EMBLEMATICO JOSE CARLOS MARIATEGUI",
+    "LA INSTITUCION EDUCATIVA N 3045",
+    "EL CENTRO DE SALUD DE SANTA ROSA",
+    "LA CARRETERA DEPARTAMENTAL LI-102",
+    "EL SISTEMA DE AGUA POTABLE DEL CENTRO POBLADO",
+    "EL MERCADO MUNICIPAL",
+]
+
+#
+# Dataset
+#
+
+def tenders_for_day(seed, day, rows_per_day):
+    # Deterministic per day so every request sees the same portal contents
+    rng = random.Random(f"{seed}:{day.isoformat()}")
+    season = 1 + 0.6 * math.sin(2 * math.pi * (day.timetuple().tm_yday - 60) / 365)
+    weekday = 1.0 if day.weekday() < 5 else 0.15
+    count = max(0, int(rng.gauss(rows_per_day * season * weekday, rows_per_day * 0.2)))
+
+    tenders = []
+    for n in range(count):
+        objeto = rng.choices([o for o, _ in OBJECTS], weights=[w for _, w in OBJECTS])[0]
+        # Early in the year some tenders still belong to the previous convocatoria
+        convocatoria = day.year - 1 if day.month <= 3 and rng.random() < 0.1 else day.year
+        entity = rng.choice(ENTITIES)
+        value = "---" if rng.random() < 0.05 else f"{rng.lognormvariate(13.5, 1.6):,.2f}"
+        tenders.append({
+            "year": convocatoria,
+            "date": day,
+            "entity": entity,
+            "published": f"{day.strftime('%d/%m/%Y')} {rng.randrange(8, 20):02d}:{rng.randrange(60):02d}",
+            "nomenclatura": f"{objeto[:2].upper()}-SM-{day.strftime('%j')}{n:03d}-{day.year}-{ENTITIES.index(entity):02d}-1",
+            "objeto": objeto,
+            "descripcion": f"{rng.choice(WORKS)} {rng.choice(PLACES)}",
+            "valor": value,
+        })
+    return tenders
+
+class Dataset:
+    def __init__(self, seed=0, rows_per_day=40):
+        self.seed = seed
+        self.rows_per_day = rows_per_day
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def day(self, day):
+        with self._lock:
+            if day not in self._days:
+                self._days[day] = tenders_for_day(self.seed, day, self.rows_per_day)
+            return self._days[day]
+
+    def search(self, year, objeto, start_date, end_date, descripcion):
+        results = []
+        day = start_date
+        while day <= end_date:
+            for tender in self.day(day):
+                if tender["year"] != year:
+                    continue
+                if objeto and tender["objeto"] != objeto:
+                    continue
+                if descripcion and descripcion.upper() not in tender["descripcion"]:
+                    continue
+                results.append(tender)
+            day += datetime.timedelta(days=1)
+        # The portal lists the most recent publications first
+        results.reverse()
+        return results
+
+def export_xlsx(tenders):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(EXPORT_HEADER)
+    for n, tender in enumerate(tenders[:LIMIT_EXPORT], start=1):
+        ws.append([
+            n, tender["entity"], tender["published"], tender["nomenclatura"], None,
+            tender["objeto"], tender["descripcion"], tender["valor"], "Soles", "3",
+        ])
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+#
+# JSF protocol
+#
+
+def search_fields(year, objeto):
+    return [
+        (FORM, FORM),
+        (f"{FORM}:anioConvocatoria_input", str(year)),
+        (OBJECT_FIELD, objeto),
+        (f"{FORM}:dfechaInicio_input", ""),
+        (f"{FORM}:dfechaFin_input", ""),
+        (f"{FORM}:descripcionObjeto", ""),
+        ("javax.faces.ViewState", ""),
+    ]
+
+def http_templates(base_url):
+    # The request templates main.py would capture from a browser run against this server
+    templates = {}
+    for mode, objeto in (("obras", "Obra"), ("vidrios", "")):
+        ajax_headers = {
+            "accept": "application/xml, text/xml, */*; q=0.01",
+            "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "faces-request": "partial/ajax",
+            "x-requested-with": "XMLHttpRequest",
+        }
+        templates[mode] = {
+            "base": base_url,
+            "prepare": [{
+                "url": base_url,
+                "headers": ajax_headers,
+                "fields": [
+                    ("javax.faces.partial.ajax", "true"),
+                    ("javax.faces.source", "tbBuscador"),
+                    ("javax.faces.behavior.event", "tabChange"),
+                    ("tbBuscador_activeIndex", "1"),
+                    ("javax.faces.ViewState", ""),
+                ],
+            }],
+            "search": {
+                "url": base_url,
+                "headers": ajax_headers,
+                "fields": [
+                    ("javax.faces.partial.ajax", "true"),
+                    ("javax.faces.source", f"{FORM}:btnBuscarSel"),
+                    ("javax.faces.partial.execute", "@all"),
+                    ("javax.faces.partial.render", f"{FORM}:dtProcesos"),
+                    (f"{FORM}:btnBuscarSel", f"{FORM}:btnBuscarSel"),
+                    *search_fields(datetime.date.today().year, objeto),
+                ],
+            },
+            "export": {
+                "url": base_url,
+                "headers": {"content-type": "application/x-www-form-urlencoded"},
+                "fields": [
+                    *search_fields(datetime.date.today().year, objeto),
+                    (f"{FORM}:btnExportar", ""),
+                ],
+            },
+        }
+    return templates
+
+def partial_response(view_state, html):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><partial-response><changes>'
+        f'<update id="{FORM}:dtProcesos"><![CDATA[{html}]]></update>'
+        f'<update id="j_id1:javax.faces.ViewState:0"><![CDATA[{view_state}]]></update>'
+        '</changes></partial-response>'
+    )
+
+VIEW_EXPIRED = (
+    '<?xml version="1.0" encoding="UTF-8"?><partial-response><error>'
+    '<error-name>javax.faces.application.ViewExpiredException</error-name>'
+    '<error-message><![CDATA[viewId:/buscadorPublico/buscadorPublico.xhtml]]></error-message>'
+    '</error></partial-response>'
+)
+
+def results_table(tenders):
+    if not tenders:
+        return (
+            f'<tbody id="{FORM}:dtProcesos_data"><tr class="ui-widget-content ui-datatable-empty-message">'
+            f'<td colspan="12">{NO_DATA_TEXT}</td></tr></tbody>'
+        )
+    rows = "".join(
+        f'<tr data-ri="{i}"><td>{i + 1}</td><td>{escape(t["entity"])}</td><td>{t["published"]}</td>'
+        f'<td>{t["nomenclatura"]}</td><td>{escape(t["descripcion"])}</td></tr>'
+        for i, t in enumerate(tenders[:15])
+    )
+    return f'<tbody id="{FORM}:dtProcesos_data">{rows}</tbody>'
+
+SEARCH_SCRIPT = """
+var FORM = "%s";
+// Just enough of PrimeFaces for main.wait_ajax_idle
+window.PrimeFaces = {ajax: {Queue: {pending: 0, isEmpty: function () { return this.pending === 0; }}}};
+
+function byId(id) { return document.getElementById(id); }
+
+function applyUpdates(text) {
+    var xml = new DOMParser().parseFromString(text, "text/xml");
+    xml.querySelectorAll("update").forEach(function (update) {
+        var id = update.getAttribute("id");
+        if (id.indexOf("javax.faces.ViewState") >= 0) {
+            byId(FORM).elements["javax.faces.ViewState"].value = update.textContent;
+        } else if (byId(id)) {
+            byId(id).innerHTML = "<table>" + update.textContent + "</table>";
+        }
+    });
+}
+
+function ajax(source, extra) {
+    var data = new URLSearchParams();
+    data.append("javax.faces.partial.ajax", "true");
+    data.append("javax.faces.source", source);
+    Object.keys(extra).forEach(function (key) { data.append(key, extra[key]); });
+    new FormData(byId(FORM)).forEach(function (value, key) { data.append(key, value); });
+    PrimeFaces.ajax.Queue.pending++;
+    return fetch(byId(FORM).action, {
+        method: "POST",
+        headers: {
+            "Accept": "application/xml, text/xml, */*; q=0.01",
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "Faces-Request": "partial/ajax",
+            "X-Requested-With": "XMLHttpRequest"
+        },
+        body: data.toString()
+    }).then(function (response) {
+        return response.ok ? response.text().then(applyUpdates) : Promise.reject(response.status);
+    }).catch(function () {
+        // A failed search leaves no rows behind, so the results never show up
+        if (extra.hasOwnProperty(FORM + ":btnBuscarSel")) {
+            byId(FORM + ":dtProcesos").innerHTML = "";
+        }
+    }).finally(function () {
+        PrimeFaces.ajax.Queue.pending--;
+    });
+}
+
+function openTab() {
+    byId("tbBuscador:tab1").style.display = "block";
+    ajax("tbBuscador", {"javax.faces.behavior.event": "tabChange", "tbBuscador_activeIndex": "1"});
+    return false;
+}
+
+function togglePanel(name) {
+    var panel = byId(FORM + ":" + name + "_panel");
+    panel.style.display = panel.style.display === "none" ? "block" : "none";
+}
+
+function selectItem(name, item) {
+    byId(FORM + ":" + name + "_input").value = item.getAttribute("data-value");
+    byId(FORM + ":" + name + "_label").textContent = item.textContent;
+    byId(FORM + ":" + name + "_panel").style.display = "none";
+    ajax(FORM + ":" + name, {"javax.faces.behavior.event": "change", "javax.faces.partial.execute": FORM + ":" + name});
+}
+
+function search() {
+    var extra = {"javax.faces.partial.execute": "@all", "javax.faces.partial.render": FORM + ":dtProcesos"};
+    extra[FORM + ":btnBuscarSel"] = FORM + ":btnBuscarSel";
+    ajax(FORM + ":btnBuscarSel", extra);
+}
+""" % FORM
+
+def select_menu(name, items):
+    # PrimeFaces selectOneMenu: hidden select, clickable label and an item panel
+    options = "".join(f'<option value="{escape(value)}">{escape(text)}</option>' for value, text in items)
+    entries = "".join(
+        f'<li data-value="{escape(value)}" onclick="selectItem(\'{name}\', this)">{escape(text)}</li>'
+        for value, text in items
+    )
+    return (
+        f'<select id="{FORM}:{name}_input" name="{FORM}:{name}_input" style="display:none">{options}</select>'
+        f'<label id="{FORM}:{name}_label" onclick="togglePanel(\'{name}\')">{escape(items[0][1])}</label>'
+        f'<div id="{FORM}:{name}_panel" style="display:none"><ul>{entries}</ul></div>'
+    )
+
+def search_page(view_state, current_year=None):
+    # The parts of buscadorPublico.xhtml main.open_search_form and the export drive
+    current_year = current_year or datetime.date.today().year
+    years = [(str(year), str(year)) for year in range(current_year, current_year - 10, -1)]
+    objects = [("", "Todos")] + [(objeto, objeto) for objeto, _ in OBJECTS]
+    object_name = OBJECT_FIELD[len(FORM) + 1:-len("_input")]
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"UTF-8\"><title>SEACE stand-in</title>"
+        f"<script>{SEARCH_SCRIPT}</script></head><body>"
+        '<div id="tbBuscador"><ul><li><a href="#" onclick="return openTab()">Buscador de Procedimientos de Selección</a></li></ul>'
+        '<div id="tbBuscador:tab1" style="display:none">'
+        f'<form id="{FORM}" name="{FORM}" method="post" action="{PATH}">'
+        f'<input type="hidden" name="{FORM}" value="{FORM}" />'
+        f'{select_menu("anioConvocatoria", years)}'
+        f'{select_menu(object_name, objects)}'
+        f'<span onclick="byId(\'{FORM}:avanzada\').style.display = \'block\'">Búsqueda Avanzada</span>'
+        f'<div id="{FORM}:avanzada" style="display:none">'
+        f'<input type="text" id="{FORM}:dfechaInicio_input" name="{FORM}:dfechaInicio_input" />'
+        f'<input type="text" id="{FORM}:dfechaFin_input" name="{FORM}:dfechaFin_input" />'
+        f'<input type="text" id="{FORM}:descripcionObjeto" name="{FORM}:descripcionObjeto" />'
+        "</div>"
+        '<button type="button" onclick="search()">Buscar</button>'
+        f'<button type="submit" name="{FORM}:btnExportar">Exportar a Excel</button>'
+        f'<div id="{FORM}:dtProcesos"><table><tbody id="{FORM}:dtProcesos_data"></tbody></table></div>'
+        f'<input type="hidden" name="javax.faces.ViewState" id="j_id1:javax.faces.ViewState:0" value="{view_state}" />'
+        "</form></div></div></body></html>"
+    )
+
+class StandinState:
+    def __init__(self, dataset, latency=0.0, failure_rate=0.0, seed=0):
+        self.dataset = dataset
+        # Mean seconds added to every POST (log-normal, so a few are much slower)
+        # and the share of searches and exports answered with an HTTP 500
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.views = {}
+        self.requests = 0
+        self.exports = 0
+        self.truncated = 0
+        self.failures = 0
+        self._counter = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def new_view(self):
+        with self._lock:
+            self._counter += 1
+            view_state = f"{self._counter}:{random.getrandbits(64):x}"
+            self.views[view_state] = {"results": None}
+        return view_state
+
+    def delay(self):
+        if self.latency <= 0:
+            return 0.0
+        with self._lock:
+            return self.latency * self._rng.lognormvariate(-0.125, 0.5)
+
+    def fails(self):
+        with self._lock:
+            if self._rng.random() >= self.failure_rate:
+                return False
+            self.failures += 1
+            return True
+
+    def expire_views(self):
+        with self._lock:
+            self.views.clear()
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, "%d/%m/%Y").date()
+
+def field(fields, suffix):
+    for key, value in fields.items():
+        if key.endswith(suffix):
+            return value
+    return ""
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type, headers=None):
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            state.requests += 1
+            if urlsplit(self.path).path != PATH:
+                self._send(404, "Not found", "text/plain")
+                return
+            self._send(200, search_page(state.new_view()), "text/html; charset=UTF-8",
+                       {"Set-Cookie": f"JSESSIONID={random.getrandbits(64):x}; Path=/"})
+
+        def do_POST(self):
+            state.requests += 1
+            length = int(self.headers.get("Content-Length") or 0)
+            fields = dict(parse_qsl(self.rfile.read(length).decode("utf-8"), keep_blank_values=True))
+            ajax = fields.get("javax.faces.partial.ajax") == "true"
+            view_state = fields.get("javax.faces.ViewState")
+            view = state.views.get(view_state)
+
+            if view is None:
+                if ajax:
+                    self._send(200, VIEW_EXPIRED, "text/xml; charset=UTF-8")
+                else:
+                    self._send(500, "javax.faces.application.ViewExpiredException", "text/html")
+                return
+
+            time.sleep(state.delay())
+            searching = ajax and fields.get("javax.faces.source", "").endswith("btnBuscarSel")
+            exporting = not ajax and any(key.endswith(":btnExportar") for key in fields)
+            if (searching or exporting) and state.fails():
+                self._send(500, "Internal Server Error", "text/html")
+                return
+
+            if searching:
+                tenders = state.dataset.search(
+                    int(field(fields, ":anioConvocatoria_input")),
+                    field(fields, OBJECT_FIELD),
+                    parse_date(field(fields, ":dfechaInicio_input")),
+                    parse_date(field(fields, ":dfechaFin_input")),
+                    field(fields, ":descripcionObjeto"),
+                )
+                view["results"] = tenders
+                self._send(200, partial_response(view_state, results_table(tenders)), "text/xml; charset=UTF-8")
+            elif ajax:
+                self._send(200, partial_response(view_state, ""), "text/xml; charset=UTF-8")
+            elif exporting:
+                tenders = view["results"] or []
+                state.exports += 1
+                if len(tenders) >= LIMIT_EXPORT:
+                    state.truncated += 1
+                self._send(200, export_xlsx(tenders), "application/vnd.ms-excel",
+                           {"Content-Disposition": 'attachment; filename="reporte.xls"'})
+            else:
+                self._send(400, "Unknown request", "text/plain")
+
+    return Handler
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Cancelled hedges and timed out attempts drop their connection mid-request
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def start_standin(port=0, seed=0, rows_per_day=40, latency=0.0, failure_rate=0.0):
+    # Serves in a background thread, returns the server and the portal URL
+    state = StandinState(Dataset(seed, rows_per_day), latency, failure_rate, seed)
+    server = StandinServer(("127.0.0.1", port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}{PATH}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the SEACE public search")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows-per-day", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds added to every POST")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of searches and exports failing with HTTP 500")
+    parser.add_argument("--write-templates", metavar="DATA_DIR",
+                        help="write the HTTP form templates for this server into DATA_DIR")
+    args = parser.parse_args()
+
+    server, url = start_standin(args.port, args.seed, args.rows_per_day, args.latency, args.failure_rate)
+    if args.write_templates:
+        for mode, template in http_templates(url).items():
+            with open(os.path.join(args.write_templates, f"http_form_{mode}.json"), "w") as f:
+                json.dump(template, f, indent=2)
+    print(f"SEACE stand-in listening on {url}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        state = server.state
+        print(
+            f"SEACE stand-in: {state.requests} requests, {state.exports} exports, "
+            f"{state.truncated} truncated, {state.failures} failures injected",
+            file=sys.stderr,
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+#!/bin/sh
+
+COMPOSE_PROVIDER="${COMPOSE_PROVIDER:-docker compose}"
+
+# "compose run" ignores restart policies, so a daemon that exits is started
+# again here after a pause
+while true; do
+    echo "### Daemon started at: $(date '+%Y-%m-%d %H:%M:%S')"
+    ${COMPOSE_PROVIDER} -f docker-compose.yml run --rm -e RUN_MODE=daemon jr-auto
+    echo "### Daemon exited with $? at: $(date '+%Y-%m-%d %H:%M:%S'), restarting in 60s"
+    sleep 60
+done
@@ -2,33 +2,259 @@ import os
 from copy import copy
 import sys
 import subprocess
+import threading
+import cProfile
+import tracemalloc
 import uuid
+import random
+import warnings
 import shutil
 import asyncio
 import time
 import datetime
+import json
+import hashlib
+import re
+import sqlite3
+from urllib.parse import parse_qsl, urlencode
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import deque
 import pytz
 import numpy as np
 import openpyxl
-from io import BytesIO
+from io import BytesIO, StringIO
 from playwright.async_api import async_playwright
 import pandas as pd
 
 LIMIT_QUERY = 499
 MAIN_SHEET_NAME = "Data filtrada"
-KEYWORDS = ["UNIVERSIDAD", "HOSPITAL", "COLEGIO"]
-KEYWORDS_VIDRIOS = ["VENTANA", "MAMPARA", "MURO CORTINA", "VIDRIO"]
+# Comma separated overrides, e.g. KEYWORDS="UNIVERSIDAD,HOSPITAL,COLEGIO,ESTADIO"
+KEYWORDS = [k.strip() for k in (os.environ.get("KEYWORDS") or "UNIVERSIDAD,HOSPITAL,COLEGIO").split(",") if k.strip()]
+KEYWORDS_VIDRIOS = [k.strip() for k in (os.environ.get("KEYWORDS_VIDRIOS") or "VENTANA,MAMPARA,MURO CORTINA,VIDRIO").split(",") if k.strip()]
 
 DATA_DIR  = os.environ.get("DATA_DIR", "./data")
-TMP_DIR   = f"{DATA_DIR}/tmp"
 QUERY_DIR = f"{DATA_DIR}/query"
 DRIVE_DIR = f"{DATA_DIR}/Onedrive"
+DENSITY_FILE = f"{DATA_DIR}/density.json"
+DB_FILE = f"{DATA_DIR}/seace.sqlite"
+# Stage timings and counters of the last run, as JSON and as a Prometheus textfile
+REPORT_FILE = f"{DATA_DIR}/run_report.json"
+METRICS_FILE = f"{DATA_DIR}/seace.prom"
+PROFILE_FILE = f"{DATA_DIR}/profile.pstats"
+# "cpu" (cProfile), "memory" (tracemalloc) or both, comma separated
+PROFILE = os.environ.get("PROFILE") or ""
 EXPORT_DIR = os.environ.get("EXPORT_DIR", "EXPORT")
+SCRAPE_CONCURRENCY = int(os.environ.get("SCRAPE_CONCURRENCY") or 4)
+# Threads parsing downloaded exports while the browser keeps fetching
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS") or 4)
+# Scraped datasets allowed to wait for the publisher, bounds the rows held in memory
+PIPELINE_DEPTH = int(os.environ.get("PIPELINE_DEPTH") or 1)
+# Daemon schedule in seconds: polls of the open days, workbook flushes, full runs
+POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL") or 900)
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL") or 3600)
+RECONCILE_INTERVAL = float(os.environ.get("RECONCILE_INTERVAL") or 86400)
+# Retries of a failed window, the backoff (seconds) doubles on each one
+WINDOW_RETRIES = int(os.environ.get("WINDOW_RETRIES") or 3)
+WINDOW_BACKOFF = float(os.environ.get("WINDOW_BACKOFF") or 2)
+# Seconds a window attempt may take, hedge included
+WINDOW_DEADLINE = float(os.environ.get("WINDOW_DEADLINE") or 600)
+# Windows slower than the p95 latency get a second attempt in a fresh context
+HEDGE = os.environ.get("HEDGE") != "no"
+HEDGE_LIMIT = int(os.environ.get("HEDGE_LIMIT") or 2)
+HEDGE_MIN_SAMPLES = 20
+# Latest latencies kept for the p95 and the reports, the daemon runs for weeks
+LATENCY_SAMPLES = 1000
+# Fraction of LIMIT_QUERY the planner aims for in each window
+PLAN_FILL = float(os.environ.get("PLAN_FILL") or 0.75)
+# Days before today that are always fetched live to pick up late edits
+RECHECK_DAYS = int(os.environ.get("RECHECK_DAYS") or 7)
+
+SEACE_URL = os.environ.get("SEACE_URL") or "https://prod2.seace.gob.pe/seacebus-uiwd-pub/buscadorPublico/buscadorPublico.xhtml"
+# "browser" drives Chromium for every window, "http" replays the captured form requests
+FETCH_ENGINE = os.environ.get("FETCH_ENGINE") or "browser"
+HTTP_CONCURRENCY = int(os.environ.get("HTTP_CONCURRENCY") or 8)
+NO_DATA_TEXT = "No se encontraron Datos"
+
+# Lean browser: blocks what the search form does not need, reuses the static
+# JSF/PrimeFaces assets across contexts and launches Chromium with fewer processes
+LEAN_BROWSER = os.environ.get("LEAN_BROWSER") != "no"
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_URLS = re.compile(os.environ.get("BLOCKED_URLS") or r"google-analytics|googletagmanager|doubleclick|facebook|twitter|hotjar")
+STATIC_URLS = re.compile(r"(?:javax|jakarta)\.faces\.resource/|\.(?:css|js)(?:\?|$)")
+LEAN_LAUNCH_ARGS = [
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+    "--disable-features=Translate,MediaRouter,OptimizationHints,BackForwardCache",
+    "--renderer-process-limit=2",
+    "--js-flags=--max-old-space-size=256",
+]
+
+# Per-step readiness timeouts in seconds, overridable with READY_TIMEOUT_<STEP>
+READY_TIMEOUTS = {
+    step: float(os.environ.get(f"READY_TIMEOUT_{step.upper()}") or default)
+    for step, default in {
+        "navigate": 60,
+        "search_form": 30,
+        "ajax": 30,
+        "results": 60,
+        "export": 120,
+    }.items()
+}
+
+REQUIRED_HEADER = [
+    'N°',
+    'Nombre o Sigla de la Entidad',
+    'Fecha y Hora de Publicacion',
+    'Nomenclatura',
+    'Reiniciado Desde',
+    'Objeto de Contratación',
+    'Descripción de Objeto',
+    'Valor Referencial / Valor Estimado',
+    'Moneda',
+    'Versión SEACE'
+]
 
 RENAME_MAP = {
     "VR / VE / Cuantía de la contratación": "Valor Referencial / Valor Estimado"
 }
 
+# Column types of the exported sheet so nothing is left to inference. Amounts and
+# dates keep the portal's text and are typed once, when the harvest store takes them.
+EXPORT_DTYPES = {
+    **{column: str for column in [*REQUIRED_HEADER, *RENAME_MAP]},
+    'N°': 'Int64',
+}
+
+#
+# Instrumentation
+#
+
+# Totals per stage and run counters, updated from the event loop and the
+# parse and publish threads. Stages nest: data_to_excel includes write_table.
+STEP_LATENCIES = {}
+RUN_COUNTERS = {}
+_metrics_lock = threading.Lock()
+
+def count(name, value=1):
+    with _metrics_lock:
+        RUN_COUNTERS[name] = RUN_COUNTERS.get(name, 0) + value
+
+# Times a block or, as a decorator, every call of a function
+@contextmanager
+def span(step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _metrics_lock:
+            stats = STEP_LATENCIES.setdefault(step, {"count": 0, "seconds": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["seconds"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+
+@asynccontextmanager
+async def timed_step(step):
+    with span(step):
+        yield
+
+def print_step_latencies():
+    for step, stats in STEP_LATENCIES.items():
+        print(
+            f"MAIN: step {step}: n={stats['count']} total={stats['seconds']:.2f}s "
+            f"mean={stats['seconds'] / stats['count']:.2f}s max={stats['max']:.2f}s"
+        )
+
+def prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def write_atomic(path, text):
+    # Readers (node_exporter, dashboards) never see a half written file
+    with open(f"{path}.tmp", "w") as f:
+        f.write(text)
+    os.replace(f"{path}.tmp", path)
+
+# Writes REPORT_FILE and METRICS_FILE at the end of a run, or after every cycle
+# of the daemon, where stages and counters keep adding up since it started.
+# PROFILE=cpu profiles the event loop thread into PROFILE_FILE, the parse and
+# publish threads only show up through their stages; PROFILE=memory adds the
+# tracemalloc peak and top allocation sites to the JSON report.
+class RunReport:
+    def __init__(self, profile=PROFILE):
+        modes = {mode.strip() for mode in profile.split(",") if mode.strip()}
+        self.started = time.time()
+        self.profiler = None
+        if "cpu" in modes:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.memory = "memory" in modes
+        if self.memory:
+            tracemalloc.start()
+
+    def write(self, components=None):
+        # `components` maps a component (planner, cache, ...) to its counters
+        finished = time.time()
+        with _metrics_lock:
+            stages = {step: dict(stats) for step, stats in STEP_LATENCIES.items()}
+            counters = dict(RUN_COUNTERS)
+        components = components or {}
+        report = {
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "finished": datetime.datetime.fromtimestamp(finished).isoformat(timespec="seconds"),
+            "duration_seconds": finished - self.started,
+            "stages": stages,
+            "counters": counters,
+            "components": components,
+        }
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(PROFILE_FILE)
+            self.profiler.enable()
+            report["profile"] = PROFILE_FILE
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:20]
+            report["memory"] = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top": [{"where": str(stat.traceback), "bytes": stat.size, "blocks": stat.count} for stat in top],
+            }
+        write_atomic(REPORT_FILE, json.dumps(report, indent=2, default=float))
+
+        lines = [
+            "# HELP seace_stage_seconds_total Time spent in a stage of the run.",
+            "# TYPE seace_stage_seconds_total counter",
+            *(f'seace_stage_seconds_total{{stage="{prometheus_label(step)}"}} {stats["seconds"]:.6f}' for step, stats in stages.items()),
+            "# HELP seace_stage_calls_total Times a stage of the run was entered.",
+            "# TYPE seace_stage_calls_total counter",
+            *(f'seace_stage_calls_total{{stage="{prometheus_label(step)}"}} {stats["count"]}' for step, stats in stages.items()),
+            "# HELP seace_events_total Portal queries and exports, truncated exports, rows kept, bytes downloaded and cells styled.",
+            "# TYPE seace_events_total counter",
+            *(f'seace_events_total{{event="{prometheus_label(name)}"}} {value}' for name, value in counters.items()),
+            "# HELP seace_component_total Counters reported by the run components.",
+            "# TYPE seace_component_total counter",
+            *(
+                f'seace_component_total{{component="{prometheus_label(component)}",counter="{prometheus_label(name)}"}} {value}'
+                for component, values in components.items() for name, value in values.items()
+            ),
+            "# HELP seace_run_duration_seconds Duration of the run, or uptime of the daemon.",
+            "# TYPE seace_run_duration_seconds gauge",
+            f"seace_run_duration_seconds {finished - self.started:.3f}",
+            "# HELP seace_run_report_timestamp_seconds When this report was written.",
+            "# TYPE seace_run_report_timestamp_seconds gauge",
+            f"seace_run_report_timestamp_seconds {finished:.3f}",
+        ]
+        write_atomic(METRICS_FILE, "\n".join(lines) + "\n")
+        print(f"MAIN: metrics written to {REPORT_FILE} and {METRICS_FILE}.")
+
 #
 # Util
 #
@@ -49,18 +275,7 @@ def validate_dataframe_header(df, rename_map=None):
     if not isinstance(rename_map, dict):
         raise TypeError("Input 'rename_map' must be a dictionary or None.")
 
-    required_header = [
-        'N°',
-        'Nombre o Sigla de la Entidad',
-        'Fecha y Hora de Publicacion',
-        'Nomenclatura',
-        'Reiniciado Desde',
-        'Objeto de Contratación',
-        'Descripción de Objeto',
-        'Valor Referencial / Valor Estimado',
-        'Moneda',
-        'Versión SEACE'
-    ]
+    required_header = REQUIRED_HEADER
 
     current_header = df.columns.tolist()
 
@@ -100,19 +315,47 @@ def validate_dataframe_header(df, rename_map=None):
     except Exception as e:
          raise ValueError(f"An error occurred during column renaming: {e}")
 
-async def general_query_data_recursive(get_data, browser, year, start_date, end_date, opts):
+async def gather_or_cancel(*coros):
+    # asyncio.gather that cancels the other coroutines once one fails, so they
+    # stop hitting the portal for a run that already failed. The journal keeps
+    # the windows they finished. The failure itself is raised, not its group.
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(coro) for coro in coros]
+    except BaseExceptionGroup as group:
+        raise group.exceptions[0]
+    return [task.result() for task in tasks]
+
+async def gather_windows(query, windows):
+    # Run the date windows concurrently; chunks keep the order of `windows`
+    results = await gather_or_cancel(*(query(start_date, end_date) for start_date, end_date in windows))
+    return [chunk for chunks in results for chunk in chunks]
+
+async def general_query_data_recursive(get_data, pool, year, start_date, end_date, opts, planner=None):
+    # Returns the window results as a list of chunks, concatenated once by the caller
+
     # Ensure the date range is valid
     if start_date > end_date:
-        return pd.DataFrame()
+        return []
 
     # Query data between start_date and end_date
-    df = await get_data(browser, year, start_date, end_date, opts)
+    df = await get_data(pool, year, start_date, end_date, opts)
     
     # DEBUG
     print(f"MAIN: query_data_recursive: {start_date} {end_date} {len(df)}")
 
-    if len(df) < LIMIT_QUERY or start_date == end_date:
-        return df
+    if planner is not None:
+        planner.observe(density_key(opts["mode"], year, opts.get("filter")), start_date, end_date, len(df))
+
+    if len(df) < LIMIT_QUERY:
+        count("rows", len(df))
+        return [df]
+    if start_date == end_date:
+        # Rows past the cap of a single day are not exported, the caller may ask again with a filter
+        print(f"MAIN: {opts['mode']} {start_date}: a single day hit the {LIMIT_QUERY} row cap, rows are missing.")
+        count("capped_days")
+        count("rows", len(df))
+        return [df]
     
     # Calculate a midpoint date within the range.
     delta_days = (end_date - start_date).days
@@ -121,26 +364,309 @@ async def general_query_data_recursive(get_data, browser, year, start_date, end_
     # To avoid potential infinite recursion if the split doesn't reduce the range,
     # make sure the midpoint is strictly before the end_date.
     if mid_date >= end_date:
-        return df
+        count("rows", len(df))
+        return [df]
 
-    # Recursively query the two halves of the date range.
-    left_df = await general_query_data_recursive(get_data, browser, year, start_date, mid_date, opts)
-    right_df = await general_query_data_recursive(get_data, browser, year, mid_date + datetime.timedelta(days=1), end_date, opts)
+    # Recursively query the two halves of the date range at the same time.
+    left_chunks, right_chunks = await gather_or_cancel(
+        general_query_data_recursive(get_data, pool, year, start_date, mid_date, opts, planner),
+        general_query_data_recursive(get_data, pool, year, mid_date + datetime.timedelta(days=1), end_date, opts, planner),
+    )
     
-    # Concatenate the results from the two halves.
-    return pd.concat([left_df, right_df], ignore_index=True)
-
-def prepare_data_for_excel(df_map, filter_filepath):
-    if os.path.exists(filter_filepath):
-        xls = pd.ExcelFile(filter_filepath)
-        for key, df in df_map.items():
-            sheet_name = key.capitalize()
-            if sheet_name in xls.sheet_names:
-                existing_df = pd.read_excel(xls, sheet_name)
-                new_rows = df[~df['Nomenclatura'].isin(existing_df['Nomenclatura'])]
-                df_map[key] = pd.concat([existing_df, new_rows], ignore_index=True)
-
-def format_table(wb, sheetname, df, display_name, output_file, temp_index_array=None):
+    # The capped result is dropped, its halves replace it
+    return left_chunks + right_chunks
+
+# Columns with a handful of distinct values, kept as categoricals in memory
+CATEGORY_COLUMNS = [
+    'Nombre o Sigla de la Entidad',
+    'Objeto de Contratación',
+    'Moneda',
+    'Versión SEACE',
+]
+
+def compact_frame(df):
+    # Harvested rows with dictionary encoded labels, a datetime publication
+    # column and the parsed amount next to the portal's text
+    df = df.drop(columns="N°", errors="ignore")
+    df = df.astype({column: "category" for column in CATEGORY_COLUMNS if column in df.columns})
+    column = df['Fecha y Hora de Publicacion']
+    published = pd.to_datetime(column, format=PUBLICATION_FORMAT, errors='coerce')
+    if (published.isna() & column.notna()).any():
+        print("MAIN: unexpected publication dates, keeping them as text.")
+    else:
+        df['Fecha y Hora de Publicacion'] = published
+    df['valor_numeric'] = parse_amounts(df['Valor Referencial / Valor Estimado'])
+    return df
+
+# Append-only list of window results, concatenated once into compact dtypes
+class ChunkAccumulator:
+    def __init__(self):
+        self.chunks = []
+        self.rows = 0
+
+    def extend(self, chunks):
+        for chunk in chunks:
+            if not chunk.empty:
+                self.chunks.append(chunk)
+                self.rows += len(chunk)
+
+    def materialize(self):
+        chunks, self.chunks = self.chunks or [empty_result()], []
+        self.rows = 0
+        return compact_frame(pd.concat(chunks, ignore_index=True))
+
+def parse_amounts(series):
+    # Drops thousands separators, currency marks and spaces in one pass,
+    # markers such as "---" become NaN
+    cleaned = series.astype(str).str.replace(r'[^0-9.\-]', '', regex=True)
+    return pd.to_numeric(cleaned, errors='coerce')
+
+def trie_pattern(words):
+    # Regex alternation factored by common prefixes, so the regex engine walks
+    # a trie instead of trying every keyword at every position
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy optional suffix: the longest keyword at a position wins
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+# Classifies texts against every keyword in a single regex scan per distinct text
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self._upper = [k.upper() for k in self.keywords]
+        # Lookahead so overlapping keywords starting at different positions are all found
+        self.pattern = re.compile(f"(?=({trie_pattern(set(self._upper))}))", re.IGNORECASE) if self.keywords else None
+        self._columns = {}
+
+    def columns(self, match):
+        # A match also implies every keyword that is a prefix of it
+        match = match.upper()
+        if match not in self._columns:
+            self._columns[match] = [i for i, k in enumerate(self._upper) if match.startswith(k)]
+        return self._columns[match]
+
+    def matrix(self, series):
+        # Boolean membership matrix, one row per text and one column per keyword
+        codes, uniques = pd.factorize(series)
+        # The extra last row stays False and is what missing texts (code -1) pick
+        unique_matrix = np.zeros((len(uniques) + 1, len(self.keywords)), dtype=bool)
+        if self.pattern is not None:
+            for i, text in enumerate(uniques):
+                for match in self.pattern.findall(str(text)):
+                    unique_matrix[i, self.columns(match)] = True
+        return pd.DataFrame(unique_matrix[codes], index=series.index, columns=self.keywords)
+
+def connect_db(path):
+    # WAL lets the publisher thread read while the scraper caches windows,
+    # and writers wait for each other instead of failing
+    con = sqlite3.connect(path, timeout=60)
+    con.execute("PRAGMA journal_mode=WAL")
+    # INSERT OR REPLACE must fire delete triggers to keep the full-text index in sync
+    con.execute("PRAGMA recursive_triggers = ON")
+    return con
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def row_fingerprints(df):
+    # One vectorized 64-bit hash per row over the string form of every value
+    text = df.astype(object).where(df.notna(), "").astype(str)
+    return pd.util.hash_pandas_object(text, index=False).to_numpy().view('int64')
+
+# Rows of every deliverable sheet indexed by Nomenclatura with a fingerprint of
+# their values. The workbook is only parsed again when it changed outside this
+# program (its digest differs from the one recorded after the last write).
+class MergeIndex:
+    def __init__(self, path):
+        self.path = path
+        self.counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        self.skipped_workbooks = 0
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS sheet_rows ("
+                " workbook TEXT NOT NULL, sheet TEXT NOT NULL, nomenclatura TEXT NOT NULL,"
+                " fingerprint INTEGER NOT NULL, data TEXT NOT NULL,"
+                " PRIMARY KEY (workbook, sheet, nomenclatura))"
+            )
+            con.execute("CREATE TABLE IF NOT EXISTS workbooks (workbook TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+
+    def _connect(self):
+        return connect_db(self.path)
+
+    def _seed(self, con, workbook, filter_filepath):
+        # Rebuild the index from the workbook, it is the source of truth after outside edits
+        print(f"MAIN: indexing {workbook}, it changed since the last run.")
+        con.execute("DELETE FROM sheet_rows WHERE workbook = ?", (workbook,))
+        if not os.path.exists(filter_filepath):
+            return
+        for sheet, df in pd.read_excel(filter_filepath, sheet_name=None).items():
+            if 'Nomenclatura' not in df.columns:
+                continue
+            df = df.dropna(subset=['Nomenclatura']).drop_duplicates('Nomenclatura', keep='last')
+            self._upsert(con, workbook, sheet, df, row_fingerprints(df))
+
+    def _upsert(self, con, workbook, sheet, df, fingerprints):
+        records = df.astype(object).where(df.notna(), None).to_dict('records')
+        con.executemany(
+            "INSERT OR REPLACE INTO sheet_rows VALUES (?, ?, ?, ?, ?)",
+            (
+                (workbook, sheet, str(record['Nomenclatura']), int(fingerprint), json.dumps(record, ensure_ascii=False, default=str))
+                for record, fingerprint in zip(records, fingerprints)
+            ),
+        )
+
+    def merge(self, df_map, filter_filepath):
+        # Returns how many rows were inserted, updated or dropped
+        workbook = os.path.basename(filter_filepath)
+        changes = 0
+        with self._connect() as con:
+            row = con.execute("SELECT digest FROM workbooks WHERE workbook = ?", (workbook,)).fetchone()
+            digest = file_digest(filter_filepath) if os.path.exists(filter_filepath) else None
+            if row is None or row[0] != digest:
+                self._seed(con, workbook, filter_filepath)
+
+            # Sheets of keywords no longer configured leave the workbook
+            sheets = [key.capitalize() for key in df_map]
+            changes += con.execute(
+                f"DELETE FROM sheet_rows WHERE workbook = ? AND sheet NOT IN ({', '.join('?' * len(sheets))})",
+                (workbook, *sheets),
+            ).rowcount
+
+            for key, df in df_map.items():
+                sheet = key.capitalize()
+                df = df.dropna(subset=['Nomenclatura']).drop_duplicates('Nomenclatura', keep='last')
+                indexed = dict(con.execute(
+                    "SELECT nomenclatura, fingerprint FROM sheet_rows WHERE workbook = ? AND sheet = ?",
+                    (workbook, sheet),
+                ).fetchall())
+
+                # Only new and changed rows are written
+                fingerprints = row_fingerprints(df)
+                # Fingerprints stay Int64, float64 would round them as soon as one row is new
+                previous = pd.Series(indexed, dtype='Int64').reindex(df['Nomenclatura'].astype(str).to_numpy())
+                inserted = previous.isna().to_numpy()
+                updated = ~inserted & (previous.fillna(0).to_numpy(dtype='int64') != fingerprints)
+                changed = inserted | updated
+                self._upsert(con, workbook, sheet, df[changed], fingerprints[changed])
+
+                self.counts["inserted"] += int(inserted.sum())
+                self.counts["updated"] += int(updated.sum())
+                self.counts["unchanged"] += int((~changed).sum())
+                changes += int(changed.sum())
+                print(f"MAIN: {workbook} {sheet}: {inserted.sum()} inserted, {updated.sum()} updated, {(~changed).sum()} unchanged")
+
+                # Rows kept from previous runs plus the upserted ones
+                records = [
+                    json.loads(data) for (data,) in con.execute(
+                        "SELECT data FROM sheet_rows WHERE workbook = ? AND sheet = ? ORDER BY rowid",
+                        (workbook, sheet),
+                    )
+                ]
+                df_map[key] = pd.DataFrame.from_records(records, columns=df.columns)
+
+            # Until commit() records the rewritten file, the index is ahead of it:
+            # a run interrupted in between indexes the old file again
+            if changes:
+                con.execute("DELETE FROM workbooks WHERE workbook = ?", (workbook,))
+        return changes
+
+    def commit(self, filter_filepath):
+        # Record the digest of the workbook just written
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO workbooks VALUES (?, ?)",
+                (os.path.basename(filter_filepath), file_digest(filter_filepath)),
+            )
+
+    def report(self):
+        print(
+            f"MAIN: merge: {self.counts['inserted']} inserted, {self.counts['updated']} updated, "
+            f"{self.counts['unchanged']} unchanged rows, {self.skipped_workbooks} workbooks left as they were"
+        )
+
+@span("prepare_data_for_excel")
+def prepare_data_for_excel(df_map, filter_filepath, merge_index):
+    return merge_index.merge(df_map, filter_filepath)
+
+def is_marked_font(font):
+    # Anything beyond the plain font written by write_table was applied by a user
+    if font.b or font.i or font.u or font.strike:
+        return True
+    color = font.color
+    if color is None:
+        return False
+    if color.type == "theme":
+        return color.theme != 1
+    return color.type == "rgb" and color.rgb not in ("FF000000", "00000000")
+
+def extract_markings(path):
+    # User fills and fonts of an existing workbook, read once in streaming mode.
+    # Returns the distinct (fill, font) markings and, per sheet,
+    # {Nomenclatura: {column name: marking index}}.
+    markings = []
+    sheets = {}
+    if not os.path.exists(path):
+        return markings, sheets
+
+    wb = openpyxl.load_workbook(path, read_only=True)
+    marking_by_style = {}
+    marking_ids = {}
+
+    def marking_for(style_id):
+        if style_id not in marking_by_style:
+            style_array = wb._cell_styles[style_id]
+            fill = wb._fills[style_array.fillId]
+            font = wb._fonts[style_array.fontId]
+            fill = fill if fill.fill_type is not None else None
+            font = font if is_marked_font(font) else None
+            marking = None
+            if fill is not None or font is not None:
+                key = (style_array.fillId, style_array.fontId if font is not None else None)
+                if key not in marking_ids:
+                    marking_ids[key] = len(markings)
+                    markings.append((copy(fill) if fill else None, copy(font) if font else None))
+                marking = marking_ids[key]
+            marking_by_style[style_id] = marking
+        return marking_by_style[style_id]
+
+    for ws in wb.worksheets:
+        rows = ws.iter_rows()
+        header = [cell.value for cell in next(rows, [])]
+        if 'Nomenclatura' not in header:
+            continue
+        key_idx = header.index('Nomenclatura')
+        marked = sheets.setdefault(ws.title, {})
+        for row in rows:
+            if len(row) <= key_idx or row[key_idx].value is None:
+                continue
+            for col_idx, cell in enumerate(row):
+                style_id = getattr(cell, "_style_id", 0)
+                if not style_id or col_idx >= len(header):
+                    continue
+                marking = marking_for(style_id)
+                if marking is not None:
+                    marked.setdefault(row[key_idx].value, {})[header[col_idx]] = marking
+    wb.close()
+    return markings, sheets
+
+@span("write_table")
+def write_table(wb, sheetname, df, display_name, markings=(), marked=None):
     # Define styles
     style = openpyxl.worksheet.table.TableStyleInfo(name="TableStyleMedium9", showFirstColumn=False,
                            showLastColumn=False, showRowStripes=True, showColumnStripes=False)
@@ -154,19 +680,26 @@ def format_table(wb, sheetname, df, display_name, output_file, temp_index_array=
         "Valor Referencial / Valor Estimado": 30
     }
 
-    # Apply the styles
+    ws = wb.create_sheet(sheetname)
+
+    # Column widths and the table must be defined before the first row is streamed
+    for idx, col_name in enumerate(df.columns, start=1):
+        col_letter = openpyxl.utils.get_column_letter(idx)
+        width = width_dict.get(col_name, 25)
+        ws.column_dimensions[col_letter].width = width
+
     table = openpyxl.worksheet.table.Table(
         displayName=display_name,
         ref=f'A1:{openpyxl.utils.get_column_letter(df.shape[1])}{len(df)+1}'
     )
+    table._initialise_columns()
+    for column, col_name in zip(table.tableColumns, df.columns):
+        column.name = str(col_name)
     table.tableStyleInfo = style
-    wb[sheetname].add_table(table)
-
-    # Set column widths based on column names
-    for idx, col_name in enumerate(df.columns, start=1):
-        col_letter = openpyxl.utils.get_column_letter(idx)
-        width = width_dict.get(col_name, 25)
-        wb[sheetname].column_dimensions[col_letter].width = width
+    with warnings.catch_warnings():
+        # The columns were named above, openpyxl warns in write-only mode regardless
+        warnings.simplefilter("ignore")
+        ws.add_table(table)
 
     # Determine target column index for "Valor Referencial / Valor Estimado"
     try:
@@ -174,202 +707,1372 @@ def format_table(wb, sheetname, df, display_name, output_file, temp_index_array=
     except ValueError:
         target_index = None
 
-    # Load the previous workbook if it exists and the sheetname is available
-    if os.path.exists(output_file):
-        old_wb = openpyxl.load_workbook(output_file)
-        if sheetname in old_wb.sheetnames:
-            old_sheet = old_wb[sheetname]
-        else:
-            old_sheet = None
-    else:
-        old_sheet = None
-
-    # Apply alignment to all cells in the table
-    for new_row_idx, row in enumerate(
-            wb[sheetname].iter_rows(min_row=1, max_row=len(df)+1, min_col=1, max_col=df.shape[1]),
-            start=1):
-        if new_row_idx == 1:
-            for cell in row:
-                cell.font = font
-                cell.alignment = alignment
-            continue
-        old_row_idx = temp_index_array[new_row_idx - 2] + 1 if temp_index_array is not None else new_row_idx
-        for cell in row:
-            col_letter = openpyxl.utils.get_column_letter(cell.column)
-            # Copy fill style from the old workbook if the sheet exists and the cell has a fill style
-            if old_sheet is not None:
-                old_cell = old_sheet[f'{col_letter}{old_row_idx}']
-                if old_cell.fill and old_cell.fill.fill_type is not None:
-                    cell.fill = copy(old_cell.fill)
-            # Apply font and alignment
+    # Cells share one style array per marking and alignment instead of setting
+    # font, alignment and fill objects cell by cell
+    styles = {}
+    def style_for(marking, right):
+        key = (marking, right)
+        if key not in styles:
+            cell = openpyxl.cell.WriteOnlyCell(ws)
             cell.font = font
-            if target_index and cell.column == target_index:
-                cell.alignment = right_alignment
+            cell.alignment = right_alignment if right else alignment
+            if marking is not None:
+                marked_fill, marked_font = markings[marking]
+                if marked_fill is not None:
+                    cell.fill = copy(marked_fill)
+                if marked_font is not None:
+                    cell.font = copy(marked_font)
+            styles[key] = cell._style
+        return styles[key]
+
+    header = []
+    for col_name in df.columns:
+        cell = openpyxl.cell.WriteOnlyCell(ws, col_name)
+        cell._style = copy(style_for(None, False))
+        header.append(cell)
+    ws.append(header)
+
+    columns = list(df.columns)
+    key_idx = columns.index('Nomenclatura') if 'Nomenclatura' in columns else None
+    values = df.astype(object).where(df.notna(), None)
+    for new_row_idx, row_values in enumerate(values.itertuples(index=False, name=None), start=2):
+        # Markings follow the Nomenclatura, wherever the row ends up
+        row_marked = {}
+        if marked and key_idx is not None:
+            row_marked = marked.get(row_values[key_idx], {})
+        row = []
+        for col_idx, value in enumerate(row_values, start=1):
+            cell = openpyxl.cell.WriteOnlyCell(ws, value)
+            cell._style = copy(style_for(row_marked.get(columns[col_idx - 1]), col_idx == target_index))
+            row.append(cell)
+
+        # Fixed row height, dropped once the row is streamed to keep memory constant
+        ws.row_dimensions[new_row_idx].height = 90
+        ws.append(row)
+        del ws.row_dimensions[new_row_idx]
+
+    count("cells_styled", (len(df) + 1) * df.shape[1])
+
+@span("data_to_excel")
+def data_to_excel(keyword_dfs, output_file):
+    # User markings of the previous workbook, carried over by Nomenclatura
+    markings, marked_sheets = extract_markings(output_file)
+
+    # Every sheet is streamed to the output in a single pass
+    wb = openpyxl.Workbook(write_only=True)
+    for keyword, df_kw in keyword_dfs.items():
+        # Sort the DataFrame by 'Fecha y Hora de Publicacion' in descending order
+        df_kw['valor_datetime'] = pd.to_datetime(
+            df_kw['Fecha y Hora de Publicacion'],
+            format='%d/%m/%Y %H:%M'
+        )
+        df_kw.sort_values(by='valor_datetime', ascending=False, inplace=True)
+        df_kw.drop('valor_datetime', axis=1, inplace=True)
+
+        sheetname = keyword.capitalize()
+        write_table(wb, sheetname, df_kw, keyword.replace(" ", "").capitalize(), markings, marked_sheets.get(sheetname))
+    wb.save(output_file)
+
+#
+# Window planning
+#
+
+def chunk_windows(start_date, end_date, days):
+    windows = []
+    cur_date = start_date
+    while cur_date <= end_date:
+        next_date = min(cur_date + datetime.timedelta(days=days - 1), end_date)
+        windows.append((cur_date, next_date))
+        cur_date = next_date + datetime.timedelta(days=1)
+    return windows
+
+def density_key(mode, year, filter=None):
+    return f"{mode}|{year}|{filter or ''}"
+
+def iter_month_overlaps(start_date, end_date):
+    # Yields (month, days) for every calendar month touched by the range
+    cur_date = start_date
+    while cur_date <= end_date:
+        if cur_date.month == 12:
+            next_month = datetime.date(cur_date.year + 1, 1, 1)
+        else:
+            next_month = datetime.date(cur_date.year, cur_date.month + 1, 1)
+        last_date = min(end_date, next_month - datetime.timedelta(days=1))
+        yield cur_date.strftime("%Y-%m"), (last_date - cur_date).days + 1
+        cur_date = last_date + datetime.timedelta(days=1)
+
+# Plans date windows from the rows-per-day observed in previous runs so that
+# each query is likely to come back under LIMIT_QUERY
+class WindowPlanner:
+    def __init__(self, path=None):
+        self.path = path
+        self.history = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.history = json.load(f)
+        self.observed = {}
+        self.spans = []
+        self.queries = 0
+        self.truncated = 0
+        # Single days over the cap per key, they cannot be bisected any further
+        self.capped = {}
+        self.capped_days = 0
+
+    def observe(self, key, start_date, end_date, rows):
+        self.queries += 1
+        if rows >= LIMIT_QUERY:
+            # Capped results only give a lower bound, the bisected halves are observed instead
+            self.truncated += 1
+            if start_date == end_date:
+                self.capped_days += 1
+                self.capped.setdefault(key, set()).add(start_date)
+            return
+        total_days = (end_date - start_date).days + 1
+        months = self.observed.setdefault(key, {})
+        for month, days in iter_month_overlaps(start_date, end_date):
+            stats = months.setdefault(month, [0.0, 0])
+            stats[0] += rows * days / total_days
+            stats[1] += days
+
+    def _months(self, key):
+        # Observations from this run replace the stored history month by month
+        return {**self.history.get(key, {}), **self.observed.get(key, {})}
+
+    def day_density(self, months, day):
+        stats = months.get(day.strftime("%Y-%m"))
+        if stats is None or stats[1] == 0:
+            # Unseen month, assume the average density of the key
+            rows = sum(r for r, _ in months.values())
+            days = sum(d for _, d in months.values())
+            return rows / days if days else 0.0
+        return stats[0] / stats[1]
+
+    def plan(self, key, start_date, end_date, default_days):
+        self.spans.append((key, start_date, end_date, default_days))
+        months = self._months(key)
+        if not months:
+            return chunk_windows(start_date, end_date, default_days)
+
+        target = LIMIT_QUERY * PLAN_FILL
+        windows = []
+        window_start = start_date
+        expected = 0.0
+        cur_date = start_date
+        while cur_date <= end_date:
+            density = self.day_density(months, cur_date)
+            if cur_date > window_start and expected + density > target:
+                windows.append((window_start, cur_date - datetime.timedelta(days=1)))
+                window_start = cur_date
+                expected = 0.0
+            expected += density
+            cur_date += datetime.timedelta(days=1)
+        windows.append((window_start, end_date))
+        return windows
+
+    def expected_rows(self, months, start_date, end_date):
+        total = 0.0
+        cur_date = start_date
+        while cur_date <= end_date:
+            total += self.day_density(months, cur_date)
+            cur_date += datetime.timedelta(days=1)
+        return total
+
+    def avoided(self):
+        # Truncated queries the fixed windows would have hit with the densities seen in this run
+        fixed = 0
+        for key, start_date, end_date, default_days in self.spans:
+            months = self._months(key)
+            for window_start, window_end in chunk_windows(start_date, end_date, default_days):
+                if self.expected_rows(months, window_start, window_end) >= LIMIT_QUERY:
+                    fixed += 1
+        return max(0, fixed - self.truncated)
+
+    def report(self):
+        print(
+            f"MAIN: planner: {self.queries} queries, {self.truncated} truncated, "
+            f"{self.avoided()} truncated queries avoided against fixed windows, "
+            f"{self.capped_days} single days over the cap"
+        )
+
+    def save(self):
+        for key, months in self.observed.items():
+            self.history.setdefault(key, {}).update(months)
+        with open(self.path, "w") as f:
+            json.dump(self.history, f, indent=2, sort_keys=True)
+
+#
+# Window cache
+#
+
+# Results of closed date windows (ending before the re-check lookback) kept on disk
+class WindowCache:
+    def __init__(self, path, current_date, recheck_days=RECHECK_DAYS, read=True):
+        self.path = path
+        self.cutoff = current_date - datetime.timedelta(days=recheck_days)
+        self.read = read
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS windows ("
+                " key TEXT, start_date TEXT, end_date TEXT, rows INTEGER, fetched_at TEXT, data TEXT,"
+                " PRIMARY KEY (key, start_date, end_date))"
+            )
+
+    def _connect(self):
+        return connect_db(self.path)
+
+    def is_closed(self, end_date):
+        return end_date < self.cutoff
+
+    def covered(self, key, start_date, end_date):
+        if not self.read:
+            return []
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT start_date, end_date FROM windows"
+                " WHERE key = ? AND start_date >= ? AND end_date <= ? AND end_date < ?"
+                " ORDER BY start_date, end_date",
+                (key, start_date.isoformat(), end_date.isoformat(), self.cutoff.isoformat()),
+            ).fetchall()
+        return [(datetime.date.fromisoformat(s), datetime.date.fromisoformat(e)) for s, e in rows]
+
+    def get(self, key, start_date, end_date):
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT data FROM windows WHERE key = ? AND start_date = ? AND end_date = ?",
+                (key, start_date.isoformat(), end_date.isoformat()),
+            ).fetchone()
+        if row is None:
+            return None
+        return pd.read_json(StringIO(row[0]), orient="split", dtype=False, convert_dates=False)
+
+    def put(self, key, start_date, end_date, df):
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key, start_date.isoformat(), end_date.isoformat(), len(df),
+                    datetime.datetime.now().isoformat(timespec="seconds"),
+                    df.to_json(orient="split", index=False),
+                ),
+            )
+
+    def _plan_gap(self, planner, key, start_date, end_date, default_days):
+        # Plan closed and open days separately so the closed windows can be cached
+        windows = []
+        closed_end = min(end_date, self.cutoff - datetime.timedelta(days=1))
+        if start_date <= closed_end:
+            windows += planner.plan(key, start_date, closed_end, default_days)
+        open_start = max(start_date, self.cutoff)
+        if open_start <= end_date:
+            windows += planner.plan(key, open_start, end_date, default_days)
+        return windows
+
+    def plan(self, planner, key, start_date, end_date, default_days):
+        # Reuse the boundaries of cached windows and plan only the gaps between them
+        windows = []
+        cur_date = start_date
+        for cached_start, cached_end in self.covered(key, start_date, end_date):
+            if cached_start < cur_date:
+                continue
+            if cached_start > cur_date:
+                windows += self._plan_gap(planner, key, cur_date, cached_start - datetime.timedelta(days=1), default_days)
+            windows.append((cached_start, cached_end))
+            cur_date = cached_end + datetime.timedelta(days=1)
+        if cur_date <= end_date:
+            windows += self._plan_gap(planner, key, cur_date, end_date, default_days)
+        return windows
+
+    def wrap(self, get_data):
+        async def cached_get_data(pool, year, start_date, end_date, opts):
+            key = density_key(opts["mode"], year, opts.get("filter"))
+            closed = self.is_closed(end_date)
+            if closed and self.read:
+                df = await asyncio.to_thread(self.get, key, start_date, end_date)
+                if df is not None:
+                    self.hits += 1
+                    return df
+            df = await get_data(pool, year, start_date, end_date, opts)
+            self.misses += 1
+            # Capped results are bisected, only their halves are worth keeping
+            if closed and len(df) < LIMIT_QUERY:
+                await asyncio.to_thread(self.put, key, start_date, end_date, df)
+            return df
+        return cached_get_data
+
+    def report(self):
+        print(f"MAIN: cache: {self.hits} windows served from disk, {self.misses} fetched live")
+
+#
+# Window retries
+#
+
+# Retries failed windows with exponential backoff and jitter, bounds every
+# attempt with a deadline and hedges attempts slower than the p95 latency of
+# their mode with a duplicate in a fresh context, keeping the first result
+class WindowRetrier:
+    def __init__(self, retries=WINDOW_RETRIES, backoff=WINDOW_BACKOFF, deadline=WINDOW_DEADLINE, hedge=HEDGE, concurrency=SCRAPE_CONCURRENCY):
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.hedge = hedge
+        self._hedges = asyncio.Semaphore(HEDGE_LIMIT)
+        # As many attempts as the pool runs at once: the deadline, the latency
+        # samples and the hedges only see attempts that hold a context
+        self._slots = asyncio.Semaphore(concurrency)
+        self.latencies = {}
+        self.window_latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.hedge_wins = deque(maxlen=LATENCY_SAMPLES)
+        self.counts = {"retries": 0, "deadlines": 0, "hedges": 0, "hedge_wins": 0}
+
+    def hedge_delay(self, mode):
+        samples = self.latencies.get(mode, [])
+        if not self.hedge or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(samples, 95))
+
+    async def _timed(self, get_data, pool, year, start_date, end_date, opts):
+        started = time.monotonic()
+        df = await get_data(pool, year, start_date, end_date, opts)
+        self.latencies.setdefault(opts["mode"], deque(maxlen=LATENCY_SAMPLES)).append(time.monotonic() - started)
+        return df
+
+    async def _hedged(self, get_data, pool, year, start_date, end_date, opts):
+        async with self._hedges:
+            return await self._timed(get_data, pool, year, start_date, end_date, {**opts, "fresh": True})
+
+    async def _attempt(self, get_data, pool, year, start_date, end_date, opts):
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._timed(get_data, pool, year, start_date, end_date, opts))
+        pending = {primary}
+        deadline = asyncio.timeout(self.deadline)
+        try:
+            async with deadline:
+                delay = self.hedge_delay(opts["mode"])
+                if delay is not None:
+                    done, _ = await asyncio.wait(pending, timeout=delay)
+                    # Hedges are skipped rather than queued once HEDGE_LIMIT are running
+                    if not done and not self._hedges.locked():
+                        self.counts["hedges"] += 1
+                        print(f"MAIN: hedging {opts['mode']} {start_date} {end_date} after {delay:.1f}s")
+                        hedged = time.monotonic()
+                        pending.add(asyncio.ensure_future(self._hedged(get_data, pool, year, start_date, end_date, opts)))
+                error = None
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is not primary:
+                                # The primary is cancelled after running this long without
+                                # answering, a lower bound of what it would have taken
+                                now = time.monotonic()
+                                self.counts["hedge_wins"] += 1
+                                self.hedge_wins.append((now - started, now - hedged))
+                            return task.result()
+                        error = task.exception()
+                raise error
+        except TimeoutError:
+            if deadline.expired():
+                self.counts["deadlines"] += 1
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def wrap(self, get_data):
+        async def retried_get_data(pool, year, start_date, end_date, opts):
+            started = None
+            for attempt in range(self.retries + 1):
+                try:
+                    async with self._slots:
+                        started = started or time.monotonic()
+                        df = await self._attempt(get_data, pool, year, start_date, end_date, opts)
+                    break
+                except ValueError:
+                    # Header drift and invalid dates fail the same way every time
+                    raise
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                    self.counts["retries"] += 1
+                    print(f"MAIN: retrying {opts['mode']} {start_date} {end_date} in {delay:.1f}s after: {e!r}")
+                    await asyncio.sleep(delay)
+            self.window_latencies.append(time.monotonic() - started)
+            return df
+        return retried_get_data
+
+    def report(self):
+        print(
+            f"MAIN: retries: {self.counts['retries']} retries, {self.counts['deadlines']} deadlines hit, "
+            f"{self.counts['hedges']} hedges launched, {self.counts['hedge_wins']} won"
+        )
+        if self.window_latencies:
+            p50, p95 = np.percentile(self.window_latencies, [50, 95])
+            print(f"MAIN: retries: windows p50 {p50:.1f}s, p95 {p95:.1f}s, max {max(self.window_latencies):.1f}s")
+        if self.hedge_wins:
+            primaries, hedges = np.array(self.hedge_wins).T
+            print(
+                f"MAIN: retries: hedges answered in {hedges.mean():.1f}s on average, "
+                f"their primaries were cancelled after {primaries.mean():.1f}s without answering, "
+                f"so the hedges were at least {(primaries - hedges).mean():.1f}s faster"
+            )
+
+#
+# Run journal
+#
+
+# Every window the current run plans and fetches, with its status and parsed
+# result. A run that died is resumed on the same day: its finished windows are
+# read back from the journal instead of being downloaded again.
+class RunJournal:
+    def __init__(self, path, current_date):
+        self.path = path
+        self.resumed = 0
+        self.fetched = 0
+        self.failed = 0
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY, run_date TEXT NOT NULL, started_at TEXT NOT NULL, finished_at TEXT)"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS journal ("
+                " run_id TEXT NOT NULL, key TEXT NOT NULL, start_date TEXT NOT NULL, end_date TEXT NOT NULL,"
+                " status TEXT NOT NULL, rows INTEGER, error TEXT, updated_at TEXT, data TEXT,"
+                " PRIMARY KEY (run_id, key, start_date, end_date))"
+            )
+            row = con.execute(
+                "SELECT run_id FROM runs WHERE run_date = ? AND finished_at IS NULL ORDER BY started_at DESC LIMIT 1",
+                (current_date.isoformat(),),
+            ).fetchone()
+            if row is not None:
+                self.run_id = row[0]
+                done, pending = con.execute(
+                    "SELECT SUM(status = 'done'), SUM(status <> 'done') FROM journal WHERE run_id = ?",
+                    (self.run_id,),
+                ).fetchone()
+                print(f"MAIN: resuming run {self.run_id}: {done or 0} windows done, {pending or 0} unfinished.")
             else:
-                cell.alignment = alignment
+                self.run_id = uuid.uuid4().hex
+                con.execute(
+                    "INSERT INTO runs VALUES (?, ?, ?, NULL)",
+                    (self.run_id, current_date.isoformat(), datetime.datetime.now().isoformat(timespec="seconds")),
+                )
+            # Runs of previous days can't be resumed, their open windows have moved on
+            con.execute("DELETE FROM journal WHERE run_id <> ?", (self.run_id,))
+
+    def _connect(self):
+        return connect_db(self.path)
+
+    def plan(self, key, windows):
+        with self._connect() as con:
+            con.executemany(
+                "INSERT OR IGNORE INTO journal (run_id, key, start_date, end_date, status, updated_at)"
+                " VALUES (?, ?, ?, ?, 'planned', ?)",
+                (
+                    (self.run_id, key, start_date.isoformat(), end_date.isoformat(), datetime.datetime.now().isoformat(timespec="seconds"))
+                    for start_date, end_date in windows
+                ),
+            )
 
-    # Set row height to auto
-    for row_num in range(2, len(df) + 2):
-        wb[sheetname].row_dimensions[row_num].height = 90
+    def get(self, key, start_date, end_date):
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT data FROM journal WHERE run_id = ? AND key = ? AND start_date = ? AND end_date = ? AND status = 'done'",
+                (self.run_id, key, start_date.isoformat(), end_date.isoformat()),
+            ).fetchone()
+        if row is None:
+            return None
+        return pd.read_json(StringIO(row[0]), orient="split", dtype=False, convert_dates=False)
+
+    def record(self, key, start_date, end_date, status, df=None, error=None):
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.run_id, key, start_date.isoformat(), end_date.isoformat(), status,
+                    None if df is None else len(df), error,
+                    datetime.datetime.now().isoformat(timespec="seconds"),
+                    None if df is None else df.to_json(orient="split", index=False),
+                ),
+            )
 
-def data_to_excel(keyword_dfs, output_file):
-    filepath = f"{TMP_DIR}/{uuid.uuid4()}.xlsx"
-    temp_indexes = {}
-    # Export all DataFrames to an Excel file with each on a separate sheet.
-    with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-        for keyword, df_kw in keyword_dfs.items():
-            # Add a temporary index column to preserve the original row positions
-            df_kw['temp_index'] = range(1, len(df_kw) + 1)
-
-            # Sort the DataFrame by 'Fecha y Hora de Publicacion' in descending order
-            df_kw['valor_datetime'] = pd.to_datetime(
-                df_kw['Fecha y Hora de Publicacion'],
-                format='%d/%m/%Y %H:%M'
+    def wrap(self, get_data):
+        async def journaled_get_data(pool, year, start_date, end_date, opts):
+            key = density_key(opts["mode"], year, opts.get("filter"))
+            df = await asyncio.to_thread(self.get, key, start_date, end_date)
+            if df is not None:
+                self.resumed += 1
+                return df
+            try:
+                df = await get_data(pool, year, start_date, end_date, opts)
+            except Exception as e:
+                self.failed += 1
+                await asyncio.to_thread(self.record, key, start_date, end_date, "failed", error=f"{type(e).__name__}: {e}")
+                raise
+            self.fetched += 1
+            try:
+                await asyncio.to_thread(self.record, key, start_date, end_date, "done", df)
+            except asyncio.CancelledError:
+                # The run is being torn down, the download must still reach the journal
+                self.record(key, start_date, end_date, "done", df)
+                raise
+            return df
+        return journaled_get_data
+
+    def finish(self):
+        # Results are only kept until the run they belong to has been published
+        with self._connect() as con:
+            con.execute(
+                "UPDATE runs SET finished_at = ? WHERE run_id = ?",
+                (datetime.datetime.now().isoformat(timespec="seconds"), self.run_id),
             )
-            df_kw.sort_values(by='valor_datetime', ascending=False, inplace=True)
-            df_kw.drop('valor_datetime', axis=1, inplace=True)
+            con.execute("DELETE FROM journal WHERE run_id = ?", (self.run_id,))
 
-            # Extract the temporary index as an array and then remove the column
-            temp_indexes[keyword] = df_kw['temp_index'].to_numpy()
-            df_kw.drop(columns=['temp_index'], inplace=True)
+    def report(self):
+        print(f"MAIN: journal: {self.resumed} windows resumed, {self.fetched} fetched, {self.failed} failed")
 
-            df_kw.to_excel(writer, sheet_name=keyword.capitalize(), index=False)
+#
+# Harvest store
+#
 
-    # Format table
-    wb = openpyxl.load_workbook(filename = filepath)
-    for keyword, df_kw in keyword_dfs.items():
-        # Retrieve the temp index array for this sheet, if available
-        temp_index_array = temp_indexes.get(keyword, None)
+# SQLite column for every harvested column, "N°" is positional and not stored
+STORE_COLUMNS = {
+    'Nombre o Sigla de la Entidad': 'entidad',
+    'Fecha y Hora de Publicacion': 'publicacion',
+    'Nomenclatura': 'nomenclatura',
+    'Reiniciado Desde': 'reiniciado',
+    'Objeto de Contratación': 'objeto',
+    'Descripción de Objeto': 'descripcion',
+    'Valor Referencial / Valor Estimado': 'valor',
+    'Moneda': 'moneda',
+    'Versión SEACE': 'version',
+}
+PUBLICATION_FORMAT = '%d/%m/%Y %H:%M'
+
+# The trigram index never matches a term shorter than a trigram
+FTS_MIN_LENGTH = 3
+
+def fts_query(keywords, column="descripcion"):
+    # Trigram phrases match substrings case-insensitively, like KeywordMatcher
+    phrases = " OR ".join('"' + keyword.replace('"', '""') + '"' for keyword in keywords)
+    return f"{column} : ({phrases})"
+
+# Typed store of the raw harvested rows, partitioned by mode and year and
+# deduplicated by Nomenclatura. Replaces the QUERY_DIR/{year}.xlsx caches.
+# Descriptions and entities are full-text indexed so keyword sheets are
+# answered locally instead of by filtered portal queries.
+class HarvestStore:
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS harvest ("
+                " mode TEXT NOT NULL, year TEXT NOT NULL,"
+                " entidad TEXT, publicacion TEXT, nomenclatura TEXT NOT NULL, reiniciado TEXT,"
+                " objeto TEXT, descripcion TEXT, valor TEXT, valor_numeric REAL, moneda TEXT, version TEXT,"
+                " PRIMARY KEY (mode, year, nomenclatura))"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS harvest_complete ("
+                " mode TEXT NOT NULL, year TEXT NOT NULL, completed_at TEXT, PRIMARY KEY (mode, year))"
+            )
+            self.fts = self._create_index(con)
 
-        format_table(wb, keyword.capitalize(), df_kw, keyword.replace(" ", "").capitalize(), output_file, temp_index_array)
-    wb.save(output_file)
+    def _create_index(self, con):
+        exists = con.execute("SELECT 1 FROM sqlite_master WHERE name = 'harvest_fts'").fetchone() is not None
+        try:
+            con.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS harvest_fts USING fts5("
+                " descripcion, entidad, content='harvest', content_rowid='rowid', tokenize='trigram')"
+            )
+        except sqlite3.OperationalError as e:
+            # SQLite without FTS5 or the trigram tokenizer (< 3.34)
+            print(f"MAIN: no full-text index, keyword sheets are filtered in memory: {e}")
+            return False
+        con.execute(
+            "CREATE TRIGGER IF NOT EXISTS harvest_fts_insert AFTER INSERT ON harvest BEGIN"
+            " INSERT INTO harvest_fts (rowid, descripcion, entidad) VALUES (new.rowid, new.descripcion, new.entidad);"
+            " END"
+        )
+        con.execute(
+            "CREATE TRIGGER IF NOT EXISTS harvest_fts_delete AFTER DELETE ON harvest BEGIN"
+            " INSERT INTO harvest_fts (harvest_fts, rowid, descripcion, entidad) VALUES ('delete', old.rowid, old.descripcion, old.entidad);"
+            " END"
+        )
+        if not exists:
+            # Index the rows harvested before the index existed
+            con.execute("INSERT INTO harvest_fts (harvest_fts) VALUES ('rebuild')")
+        return True
+
+    def _connect(self):
+        return connect_db(self.path)
+
+    def is_complete(self, mode, year):
+        with self._connect() as con:
+            row = con.execute("SELECT 1 FROM harvest_complete WHERE mode = ? AND year = ?", (mode, year)).fetchone()
+        return row is not None
+
+    def mark_complete(self, mode, year):
+        # A year harvested after it ended will not change anymore
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO harvest_complete VALUES (?, ?, ?)",
+                (mode, year, datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+
+    @span("store_write")
+    def write(self, mode, year, df, replace=True):
+        # Later rows win when a Nomenclatura is harvested again, unless
+        # `replace` is off (imports of old files must not undo newer rows)
+        if df.empty:
+            return 0
+        data = pd.DataFrame({column: df[name] for name, column in STORE_COLUMNS.items()})
+        published = pd.to_datetime(data['publicacion'], format=PUBLICATION_FORMAT, errors='coerce')
+        data['publicacion'] = published.dt.strftime('%Y-%m-%d %H:%M').where(published.notna(), data['publicacion'])
+        data['valor_numeric'] = df['valor_numeric'] if 'valor_numeric' in df.columns else parse_amounts(data['valor'])
+        data = data.dropna(subset=['nomenclatura']).drop_duplicates('nomenclatura', keep='last')
+        data = data.astype(object).where(data.notna(), None)
+
+        columns = ['mode', 'year', *data.columns]
+        rows = ((mode, year, *row) for row in data.itertuples(index=False, name=None))
+        with self._connect() as con:
+            con.executemany(
+                f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO harvest ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                rows,
+            )
+        return len(data)
+
+    def read(self, mode, year, columns=None, min_value=None, keywords=None):
+        # Projection, the amount predicate and the keyword match run inside SQLite
+        if keywords is not None and (not self.fts or any(len(keyword) < FTS_MIN_LENGTH for keyword in keywords)):
+            df = self.read(mode, year, columns, min_value)
+            return df[KeywordMatcher(keywords).matrix(df['Descripción de Objeto']).any(axis=1).to_numpy()]
+        names = [name for name in STORE_COLUMNS if columns is None or name in columns]
+        sql = f"SELECT {', '.join(STORE_COLUMNS[name] for name in names)} FROM harvest WHERE mode = ? AND year = ?"
+        params = [mode, year]
+        if min_value is not None:
+            sql += " AND (valor_numeric > ? OR valor_numeric IS NULL)"
+            params.append(min_value)
+        if keywords is not None:
+            sql += " AND rowid IN (SELECT rowid FROM harvest_fts WHERE harvest_fts MATCH ?)"
+            params.append(fts_query(keywords))
+        sql += " ORDER BY publicacion"
+        with self._connect() as con:
+            df = pd.DataFrame(con.execute(sql, params).fetchall(), columns=names)
+
+        if 'Fecha y Hora de Publicacion' in df.columns:
+            column = df['Fecha y Hora de Publicacion']
+            published = pd.to_datetime(column, format='%Y-%m-%d %H:%M', errors='coerce')
+            df['Fecha y Hora de Publicacion'] = published.dt.strftime(PUBLICATION_FORMAT).where(published.notna(), column)
+        return df
+
+    def matches(self, mode, year, keywords):
+        # Nomenclaturas whose description contains each keyword, one index lookup
+        # per keyword. Keywords the index cannot answer are classified here.
+        scanned = [keyword for keyword in keywords if not self.fts or len(keyword) < FTS_MIN_LENGTH]
+        matches = {}
+        if scanned:
+            df = self.read(mode, year, columns=['Nomenclatura', 'Descripción de Objeto'])
+            membership = KeywordMatcher(scanned).matrix(df['Descripción de Objeto'])
+            matches = {keyword: set(df['Nomenclatura'][membership[keyword].to_numpy()]) for keyword in scanned}
+        with self._connect() as con:
+            for keyword in keywords:
+                if keyword in matches:
+                    continue
+                matches[keyword] = {
+                    nomenclatura for (nomenclatura,) in con.execute(
+                        "SELECT nomenclatura FROM harvest WHERE mode = ? AND year = ?"
+                        " AND rowid IN (SELECT rowid FROM harvest_fts WHERE harvest_fts MATCH ?)",
+                        (mode, year, fts_query([keyword])),
+                    )
+                }
+        return {keyword: matches[keyword] for keyword in keywords}
+
+#
+# Page readiness
+#
+
+OBJECT_TYPES = {
+    "obras": "Obra",
+    "vidrios": None,
+}
+
+class ViewExpiredError(Exception):
+    pass
+
+def form_field(page, name):
+    return page.locator(f"[id=\"tbBuscador\\:idFormBuscarProceso\\:{name}\"]")
+
+def step_timeout(step):
+    # Playwright expects milliseconds
+    return READY_TIMEOUTS[step] * 1000
+
+async def wait_ajax_idle(page):
+    # PrimeFaces queues its partial requests, an empty queue means the DOM update was applied
+    await page.wait_for_function(
+        "() => !window.PrimeFaces || !PrimeFaces.ajax || !PrimeFaces.ajax.Queue"
+        " || PrimeFaces.ajax.Queue.isEmpty()",
+        timeout=step_timeout("ajax"),
+    )
+
+async def open_search_form(page, year, object_type=None):
+    async with timed_step("navigate"):
+        await page.goto(SEACE_URL, timeout=step_timeout("navigate"))
+        await page.get_by_role("link", name="Buscador de Procedimientos de").click()
+
+    async with timed_step("search_form"):
+        await form_field(page, "anioConvocatoria_label").wait_for(state="visible", timeout=step_timeout("search_form"))
+        await wait_ajax_idle(page)
+
+    async with timed_step("prepare"):
+        await form_field(page, "anioConvocatoria_label").click()
+        await form_field(page, "anioConvocatoria_panel").get_by_text(year).click()
+        await wait_ajax_idle(page)
+        if object_type is not None:
+            await page.locator("[id^=\"tbBuscador\\:idFormBuscarProceso\\:j_idt\"][id$=\"_panel\"]").get_by_text(object_type, exact=True).dispatch_event("click")
+            await wait_ajax_idle(page)
+        await page.get_by_text("Búsqueda Avanzada").click()
+        await form_field(page, "dfechaInicio_input").wait_for(state="visible", timeout=step_timeout("search_form"))
+
+async def fill_field(page, name, value):
+    await form_field(page, name).click()
+    await form_field(page, name).fill(value)
+
+async def submit_search(page):
+    # Returns False when the portal reports no results for the current filters
+    count("queries")
+    async with timed_step("ajax"):
+        async with page.expect_response(
+            lambda response: response.request.method == "POST" and "buscadorPublico" in response.url,
+            timeout=step_timeout("ajax"),
+        ) as response_info:
+            await page.get_by_role("button", name="Buscar").click()
+        response = await response_info.value
+        # An expired view answers the partial request with an error instead of the table update
+        if "ViewExpiredException" in await response.text():
+            raise ViewExpiredError("JSF view expired")
+        await wait_ajax_idle(page)
+
+    async with timed_step("results"):
+        table = form_field(page, "dtProcesos_data")
+        await table.locator("tr").first.wait_for(state="attached", timeout=step_timeout("results"))
+        text = await table.inner_text(timeout=step_timeout("results"))
+    return NO_DATA_TEXT not in text
+
+async def export_results(page):
+    async with timed_step("export"):
+        async with page.expect_download(timeout=step_timeout("export")) as download_info:
+            await page.get_by_role("button", name="Exportar a Excel").click()
+        download = await download_info.value
+        # Take the bytes of the browser's own copy, nothing is saved under DATA_DIR
+        with open(await download.path(), "rb") as f:
+            body = f.read()
+        await download.delete()
+    return body
+
+def empty_result():
+    return pd.DataFrame(columns=REQUIRED_HEADER)
+
+def read_export(mode, body):
+    count("exports")
+    count("bytes_downloaded", len(body))
+    with span("read_excel"):
+        df = pd.read_excel(BytesIO(body), dtype=EXPORT_DTYPES)
+    if len(df) >= LIMIT_QUERY:
+        count("truncated_windows")
+    if mode == "vidrios":
+        df = df[::-1].reset_index(drop=True)
+
+    df = validate_dataframe_header(df, RENAME_MAP)
+
+    return df
+
+#
+# Lean browser
+#
+
+# Request interception for every context of the pool plus per-page accounting
+# of requests and transferred bytes
+class LeanBrowser:
+    def __init__(self, enabled=LEAN_BROWSER):
+        self.enabled = enabled
+        self._assets = {}
+        self.pages = 0
+        self.requests = 0
+        self.transferred = 0
+        self.counts = {"blocked": 0, "cached": 0, "fetched": 0}
+
+    def launch_args(self):
+        return LEAN_LAUNCH_ARGS if self.enabled else []
+
+    async def new_context(self, browser):
+        if not self.enabled:
+            context = await browser.new_context()
+        else:
+            context = await browser.new_context(service_workers="block")
+            try:
+                await context.route("**/*", self._route)
+            except BaseException:
+                await context.close()
+                raise
+        context.on("page", self._track)
+        return context
+
+    async def _route(self, route):
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or BLOCKED_URLS.search(request.url):
+            self.counts["blocked"] += 1
+            await route.abort()
+            return
+        if request.method != "GET" or not STATIC_URLS.search(request.url):
+            await route.continue_()
+            return
+
+        asset = self._assets.get(request.url)
+        if asset is not None:
+            self.counts["cached"] += 1
+            status, headers, body = asset
+            await route.fulfill(status=status, headers=headers, body=body)
+            return
+        response = await route.fetch()
+        body = await response.body()
+        self.counts["fetched"] += 1
+        if response.status == 200:
+            # The body is already decoded, its transfer headers no longer apply
+            headers = {
+                k: v for k, v in response.headers.items()
+                if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")
+            }
+            self._assets[request.url] = (response.status, headers, body)
+        await route.fulfill(response=response, body=body)
+
+    def _track(self, page):
+        self.pages += 1
+
+        async def finished(request):
+            self.requests += 1
+            try:
+                sizes = await request.sizes()
+            except Exception:
+                return
+            self.transferred += sizes["responseHeadersSize"] + sizes["responseBodySize"] + sizes["requestHeadersSize"] + sizes["requestBodySize"]
+
+        page.on("requestfinished", finished)
+
+    def report(self):
+        if not self.pages:
+            return
+        print(
+            f"MAIN: browser: {self.pages} pages, {self.requests} requests ({self.requests / self.pages:.1f}/page), "
+            f"{self.transferred / 1e6:.2f} MB ({self.transferred / 1e3 / self.pages:.0f} KB/page)"
+        )
+        if self.enabled:
+            print(
+                f"MAIN: browser: {self.counts['blocked']} requests blocked, "
+                f"{self.counts['cached']} static assets served from memory, {self.counts['fetched']} fetched"
+            )
+
+#
+# Browser sessions
+#
+
+# Search form prepared once for a mode and year, re-filled for every date window
+class SearchSession:
+    def __init__(self, context, mode, year):
+        self.context = context
+        self.mode = mode
+        self.year = year
+        self.page = None
+
+    @property
+    def key(self):
+        return (self.mode, self.year)
+
+    async def prepare(self):
+        await self.close()
+        self.page = await self.context.new_page()
+        await open_search_form(self.page, self.year, OBJECT_TYPES[self.mode])
+
+    async def close(self):
+        if self.page is not None:
+            page, self.page = self.page, None
+            await page.close()
+
+    async def _export(self, f_start_date, f_end_date, filtro):
+        await fill_field(self.page, "dfechaInicio_input", f_start_date)
+        await fill_field(self.page, "dfechaFin_input", f_end_date)
+        if filtro is not None:
+            await fill_field(self.page, "descripcionObjeto", filtro)
+
+        # Wait for the filter, there is nothing to export on an empty result
+        if not await submit_search(self.page):
+            return None
+
+        # Download the results
+        return await export_results(self.page)
+
+    async def export(self, start_date, end_date, filtro=None):
+        f_start_date = start_date.strftime("%d/%m/%Y")
+        f_end_date = end_date.strftime("%d/%m/%Y")
+
+        warm = self.page is not None
+        if not warm:
+            await self.prepare()
+        try:
+            return await self._export(f_start_date, f_end_date, filtro)
+        except Exception as e:
+            # A reused page may hold an expired JSF view, rebuild it once and retry
+            if not warm:
+                raise
+            print(f"MAIN: rebuilding {self.mode} {self.year} search page after: {e!r}")
+            await self.prepare()
+            return await self._export(f_start_date, f_end_date, filtro)
+
+# Bounded pool of reusable browser contexts shared by concurrent queries.
+# Each context keeps its last search session warm for the next window.
+class ContextPool:
+    def __init__(self, browser, size, lean=None):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.browser = browser
+        self.size = size
+        self.lean = lean or LeanBrowser(enabled=False)
+        self._idle = []
+        self._created = 0
+        self._released = asyncio.Condition()
+
+    async def _acquire(self, key):
+        async with self._released:
+            while True:
+                # Prefer a context whose page is already prepared for this search
+                for i, (context, session) in enumerate(self._idle):
+                    if session is not None and session.key == key:
+                        return self._idle.pop(i)
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                if self._idle:
+                    return self._idle.pop(0)
+                try:
+                    await self._released.wait()
+                except asyncio.CancelledError:
+                    # Pass on the release this waiter may have been woken for
+                    self._released.notify()
+                    raise
+        try:
+            return await self.lean.new_context(self.browser), None
+        except BaseException:
+            # Failed or cancelled (deadline, hedge won): the slot is free again
+            await asyncio.shield(self._discard(None))
+            raise
+
+    async def _release(self, context, session):
+        async with self._released:
+            self._idle.append((context, session))
+            self._released.notify()
+
+    async def _discard(self, context):
+        async with self._released:
+            self._created -= 1
+            self._released.notify()
+        if context is not None:
+            await context.close()
+
+    @asynccontextmanager
+    async def session(self, mode, year, fresh=False):
+        if fresh:
+            # Throwaway context outside the pool, a hedged attempt must not wait for a slot
+            context = await self.lean.new_context(self.browser)
+            try:
+                yield SearchSession(context, mode, year)
+            finally:
+                await context.close()
+            return
+        context, session = await self._acquire((mode, year))
+        try:
+            if session is None or session.key != (mode, year):
+                if session is not None:
+                    await session.close()
+                session = SearchSession(context, mode, year)
+            yield session
+        except BaseException:
+            # Do not hand a possibly broken context to the next query
+            await asyncio.shield(self._discard(context))
+            raise
+        # Shielded, a cancellation arriving now must not lose the slot
+        await asyncio.shield(self._release(context, session))
+
+    async def close(self):
+        async with self._released:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for context, _ in idle:
+            await context.close()
+
+#
+# HTTP export
+#
+
+class FormDriftError(Exception):
+    pass
+
+# The portal failed the request itself (5xx), worth retrying with the same template
+class PortalError(Exception):
+    pass
+
+def http_template_path(mode):
+    return f"{DATA_DIR}/http_form_{mode}.json"
+
+def template_request(request):
+    # Keep only what is needed to replay the request outside the browser
+    headers = {
+        k: v for k, v in request.headers.items()
+        if k.lower() in ("accept", "content-type", "faces-request", "x-requested-with")
+    }
+    return {
+        "url": re.sub(r";jsessionid=[^?]*", "", request.url),
+        "headers": headers,
+        "fields": parse_qsl(request.post_data or "", keep_blank_values=True),
+    }
+
+def validate_http_template(template):
+    keys = [k for k, _ in template["search"]["fields"]]
+    for suffix in (".ViewState", ":dfechaInicio_input", ":dfechaFin_input"):
+        if not any(k.endswith(suffix) for k in keys):
+            raise FormDriftError(f"Search request has no field ending in {suffix}")
+    if template.get("base") != SEACE_URL:
+        raise FormDriftError("Template was captured for another portal URL")
+    return template
+
+async def capture_http_template(pool, mode, year):
+    # Record the POSTs the browser sends to prepare, search and export one window
+    recorded = []
+    def on_request(request):
+        if request.method == "POST" and "buscadorPublico" in request.url:
+            recorded.append(request)
+
+    async with pool.session(mode, year) as session:
+        session.context.on("request", on_request)
+        try:
+            await session.prepare()
+            prepare = [template_request(r) for r in recorded]
+            recorded.clear()
+
+            start_date = datetime.date(int(year), 1, 1)
+            await fill_field(session.page, "dfechaInicio_input", start_date.strftime("%d/%m/%Y"))
+            await fill_field(session.page, "dfechaFin_input", (start_date + datetime.timedelta(days=30)).strftime("%d/%m/%Y"))
+            if not await submit_search(session.page) or not recorded:
+                raise FormDriftError("Could not capture a search with results")
+            search = template_request(recorded[-1])
+            recorded.clear()
+
+            await export_results(session.page)
+            if not recorded:
+                raise FormDriftError("Could not capture the export request")
+            export = template_request(recorded[-1])
+        finally:
+            session.context.remove_listener("request", on_request)
+
+    return validate_http_template({
+        "base": SEACE_URL,
+        "prepare": prepare,
+        "search": search,
+        "export": export,
+    })
+
+def parse_view_state(text):
+    # Full page: hidden input, partial response: <update id="...ViewState..."><![CDATA[...]]>
+    match = re.search(r'name="(?:javax|jakarta)\.faces\.ViewState"[^>]*value="([^"]*)"', text)
+    if match is None:
+        match = re.search(r'faces\.ViewState[^"]*"><!\[CDATA\[(.*?)\]\]>', text)
+    return match.group(1) if match else None
+
+def is_excel(body):
+    # Legacy .xls (OLE2) or .xlsx (zip)
+    return body[:4] == b"\xd0\xcf\x11\xe0" or body[:2] == b"PK"
+
+# One JSF view with its own cookie jar, searches and exports must not interleave on it
+class HttpView:
+    def __init__(self, client, template):
+        self.client = client
+        self.template = template
+        self.view_state = None
+        self.year = None
+
+    async def _post(self, request, values):
+        fields = []
+        for key, value in request["fields"]:
+            if key.endswith(".ViewState"):
+                value = self.view_state
+            else:
+                for suffix, new_value in values.items():
+                    if key.endswith(suffix):
+                        value = new_value
+            fields.append((key, value))
+        response = await self.client.post(
+            request["url"],
+            headers=request["headers"],
+            data=urlencode(fields),
+            timeout=step_timeout("export"),
+        )
+        body = await response.body()
+        if b"ViewExpiredException" in body:
+            raise ViewExpiredError("JSF view expired")
+        if response.status >= 500:
+            raise PortalError(f"HTTP {response.status} from {request['url']}")
+        if response.status != 200:
+            raise FormDriftError(f"HTTP {response.status} from {request['url']}")
+        view_state = parse_view_state(body.decode("utf-8", errors="ignore"))
+        if view_state is not None:
+            self.view_state = view_state
+        return body
+
+    async def prepare(self, year):
+        async with timed_step("navigate"):
+            response = await self.client.get(SEACE_URL, timeout=step_timeout("navigate"))
+            if response.status >= 500:
+                raise PortalError(f"HTTP {response.status} from {SEACE_URL}")
+            self.view_state = parse_view_state(await response.text())
+        if self.view_state is None:
+            raise FormDriftError("No ViewState in the search page")
+        async with timed_step("prepare"):
+            for request in self.template["prepare"]:
+                await self._post(request, {":anioConvocatoria_input": year})
+        self.year = year
+
+    async def export(self, year, start_date, end_date, filtro):
+        if self.year != year:
+            await self.prepare(year)
+        values = {
+            ":anioConvocatoria_input": year,
+            ":dfechaInicio_input": start_date.strftime("%d/%m/%Y"),
+            ":dfechaFin_input": end_date.strftime("%d/%m/%Y"),
+        }
+        if filtro is not None:
+            values[":descripcionObjeto"] = filtro
+
+        count("queries")
+        async with timed_step("ajax"):
+            body = await self._post(self.template["search"], values)
+        if NO_DATA_TEXT.encode() in body:
+            return None
+
+        async with timed_step("export"):
+            body = await self._post(self.template["export"], values)
+        if not is_excel(body):
+            raise FormDriftError("Export did not return an Excel file")
+        return body
+
+    async def close(self):
+        await self.client.dispose()
+
+# Replays the JSF search/export requests over pooled keep-alive HTTP clients,
+# falling back to the browser when the form no longer matches the template
+class HttpExporter:
+    def __init__(self, request, size):
+        self.request = request
+        self._slots = asyncio.Semaphore(size)
+        self._idle = {}
+        self._templates = {}
+        self._recaptured = set()
+        self._lock = asyncio.Lock()
+        self.http_windows = 0
+        self.browser_windows = 0
+
+    async def _template(self, pool, mode, year):
+        async with self._lock:
+            if mode not in self._templates:
+                self._templates[mode] = await self._load_template(pool, mode, year)
+            return self._templates[mode]
+
+    async def _load_template(self, pool, mode, year):
+        path = http_template_path(mode)
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    return validate_http_template(json.load(f))
+            except (ValueError, KeyError, FormDriftError) as e:
+                print(f"MAIN: discarding HTTP template {path}: {e}")
+        try:
+            template = await capture_http_template(pool, mode, year)
+        except Exception as e:
+            print(f"MAIN: HTTP template capture failed for {mode}, using the browser: {e!r}")
+            return None
+        with open(path, "w") as f:
+            json.dump(template, f, indent=2)
+        return template
+
+    async def _drifted(self, mode):
+        async with self._lock:
+            if os.path.exists(http_template_path(mode)):
+                os.remove(http_template_path(mode))
+            # Capture again once, then give up on HTTP for this mode
+            if mode in self._recaptured:
+                self._templates[mode] = None
+            else:
+                self._recaptured.add(mode)
+                self._templates.pop(mode, None)
+            idle = self._idle.pop(mode, [])
+        for view in idle:
+            await view.close()
+
+    @asynccontextmanager
+    async def _view(self, mode, template, fresh=False):
+        if fresh:
+            # New client outside the slots for hedged attempts
+            view = HttpView(await self.request.new_context(), template)
+            try:
+                yield view
+            finally:
+                await view.close()
+            return
+        async with self._slots:
+            idle = self._idle.setdefault(mode, [])
+            view = idle.pop() if idle else HttpView(await self.request.new_context(), template)
+            try:
+                yield view
+            except BaseException:
+                await view.close()
+                raise
+            if view.template is self._templates.get(mode):
+                self._idle.setdefault(mode, []).append(view)
+            else:
+                await view.close()
+
+    async def _export(self, mode, template, year, start_date, end_date, filtro, fresh=False):
+        async with self._view(mode, template, fresh) as view:
+            try:
+                return await view.export(year, start_date, end_date, filtro)
+            except ViewExpiredError:
+                await view.prepare(year)
+                return await view.export(year, start_date, end_date, filtro)
+
+    async def get_data(self, pool, year, start_date, end_date, opts):
+        mode = opts["mode"]
+        if end_date < start_date:
+            raise ValueError("end_date cannot be before start_date")
+
+        template = await self._template(pool, mode, year)
+        if template is not None:
+            try:
+                body = await self._export(mode, template, year, start_date, end_date, opts.get("filter"), opts.get("fresh", False))
+            except FormDriftError as e:
+                print(f"MAIN: HTTP export drifted for {mode}, falling back to the browser: {e}")
+                await self._drifted(mode)
+            else:
+                self.http_windows += 1
+                if body is None:
+                    return empty_result()
+                return await asyncio.to_thread(read_export, mode, body)
+
+        self.browser_windows += 1
+        get_data = get_data_obras if mode == "obras" else get_data_vidrios
+        return await get_data(pool, year, start_date, end_date, opts)
+
+    def report(self):
+        print(f"MAIN: http: {self.http_windows} windows over HTTP, {self.browser_windows} through the browser")
+
+    async def close(self):
+        for idle in self._idle.values():
+            for view in idle:
+                await view.close()
+        self._idle = {}
 
 #
 # OBRAS
 #
 
-async def get_data_obras(browser, year, start_date, end_date, opts):
+async def get_data_obras(pool, year, start_date, end_date, opts):
     # Check if end_date is before start_date
     if end_date < start_date:
         raise ValueError("end_date cannot be before start_date")
 
-    # Format and print the dates
-    f_start_date = start_date.strftime("%d/%m/%Y")
-    f_end_date = end_date.strftime("%d/%m/%Y")
-
-    # Start page instance
-    context = await browser.new_context()
-    page = await context.new_page()
-
-    # Web scraping
-    await page.goto("https://prod2.seace.gob.pe/seacebus-uiwd-pub/buscadorPublico/buscadorPublico.xhtml")
-    await page.get_by_role("link", name="Buscador de Procedimientos de").click()
-    time.sleep(9)
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:anioConvocatoria_label\"]").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:anioConvocatoria_panel\"]").get_by_text(year).click()
-    await page.locator("[id^=\"tbBuscador\\:idFormBuscarProceso\\:j_idt\"][id$=\"_panel\"]").get_by_text("Obra", exact=True).dispatch_event("click")
-    await page.get_by_text("Búsqueda Avanzada").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dfechaInicio_input\"]").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dfechaInicio_input\"]").fill(f_start_date)
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dfechaFin_input\"]").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dfechaFin_input\"]").fill(f_end_date)
-    await page.get_by_role("button", name="Buscar").click()
-    #await page.pause()
-
-    # Wait for the filter
-    #await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dtProcesos_data\"]").filter(has_not_text="No se encontraron Datos").click()
-    time.sleep(6)
-
-    # Download the results
-    async with page.expect_download() as download_info:
-        await page.get_by_role("button", name="Exportar a Excel").click()
-    download = await download_info.value
-    filepath = f"{TMP_DIR}/{uuid.uuid4()}.xls"
-    await download.save_as(filepath)
-
-    # Cleanup
-    await page.close()
-    await context.close()
-
-    df = pd.read_excel(filepath)
-
-    df = validate_dataframe_header(df, RENAME_MAP)
+    async with pool.session("obras", year, opts.get("fresh", False)) as session:
+        body = await session.export(start_date, end_date)
+    if body is None:
+        return empty_result()
 
-    return df
+    return await asyncio.to_thread(read_export, "obras", body)
 
-async def query_obras_data(browser, year, current_date):
-    async def query_data_recursive(start_date, end_date):
-        return await general_query_data_recursive(get_data_obras, browser, year, start_date, end_date, {})
+def obras_spans(given_year, current_date):
+    # Contiguous date spans to query with the window size the fixed plan used for each
+    spans = []
 
-    given_year = int(year)
-    results = []
-    
-    # Only proceed if given_year is less than or equal to current year
-    if given_year > current_date.year:
-        return pd.DataFrame()
-    
     # 1. Process the given year in 15-day chunks
     # If the given year is the current year, query only until current_date,
     # otherwise query the full year (January 1 to December 31)
     start_date_given = datetime.date(given_year, 1, 1)
     end_date_given = current_date if given_year == current_date.year else datetime.date(given_year, 12, 31)
-    
-    cur_date = start_date_given
-    while cur_date <= end_date_given:
-        # Define a 15-day window (including cur_date)
-        next_date = cur_date + datetime.timedelta(days=14)
-        if next_date > end_date_given:
-            next_date = end_date_given
-        df_part = await query_data_recursive(cur_date, next_date)
-        results.append(df_part)
-        # Move to the day after next_date for the next interval.
-        cur_date = next_date + datetime.timedelta(days=1)
-    
+    spans.append((start_date_given, end_date_given, 15))
+
     # 2. Process each full year after the given year up to (but not including) the current year.
     for yr in range(given_year + 1, current_date.year):
         start_date_year = datetime.date(yr, 1, 1)
         end_date_year = datetime.date(yr, 12, 31)
-        mid_date = start_date_year + (end_date_year - start_date_year) // 2
-        df_first_half = await query_data_recursive(start_date_year, mid_date)
-        df_second_half = await query_data_recursive(mid_date + datetime.timedelta(days=1), end_date_year)
-        results.append(pd.concat([df_first_half, df_second_half], ignore_index=True))
+        days = (end_date_year - start_date_year).days + 1
+        spans.append((start_date_year, end_date_year, (days + 1) // 2))
 
     # 3. Process the current year (if it's after the given year) from January 1 to today.
     if current_date.year > given_year:
         start_date_current = datetime.date(current_date.year, 1, 1)
         end_date_current = current_date
-        if (end_date_current - start_date_current).days + 1 > 300:
-            mid_date = start_date_current + (end_date_current - start_date_current) // 2
-            df_first_half = await query_data_recursive(start_date_current, mid_date)
-            df_second_half = await query_data_recursive(mid_date + timedelta(days=1), end_date_current)
-            df_current = pd.concat([df_first_half, df_second_half], ignore_index=True)
-        else:
-            df_current = await query_data_recursive(start_date_current, end_date_current)
-        results.append(df_current)
+        days = (end_date_current - start_date_current).days + 1
+        spans.append((start_date_current, end_date_current, (days + 1) // 2 if days > 300 else days))
 
-    # Combine all data into one DataFrame
-    if results:
-        return pd.concat(results, ignore_index=True)
-    else:
+    return spans
+
+async def query_obras_data(pool, year, current_date, planner, cache, get_data=None, journal=None, retrier=None):
+    get_data = get_data or get_data_obras
+    if retrier is not None:
+        get_data = retrier.wrap(get_data)
+    if journal is not None:
+        get_data = journal.wrap(get_data)
+    get_data = cache.wrap(get_data)
+
+    async def query_data_recursive(start_date, end_date):
+        return await general_query_data_recursive(get_data, pool, year, start_date, end_date, {"mode": "obras"}, planner)
+
+    given_year = int(year)
+
+    # Only proceed if given_year is less than or equal to current year
+    if given_year > current_date.year:
         return pd.DataFrame()
 
-def filter_data_obras(df, lower_bound):
-    def convert_to_float(x):
-        try:
-            return float(x.replace(',', ''))
-        except Exception:
-            return np.nan
+    key = density_key("obras", year)
+    windows = [
+        window
+        for start_date, end_date, days in obras_spans(given_year, current_date)
+        for window in cache.plan(planner, key, start_date, end_date, days)
+    ]
+    if journal is not None:
+        journal.plan(key, windows)
+    accumulator = ChunkAccumulator()
+    accumulator.extend(await gather_windows(query_data_recursive, windows))
+
+    # Combine all data into one DataFrame
+    return accumulator.materialize()
+
+@span("filter_data_obras")
+def filter_data_obras(df, lower_bound, keywords=None, matches=None):
+    # `matches` maps each keyword to its Nomenclaturas (HarvestStore.matches),
+    # without it the descriptions are classified here
+    if keywords is None:
+        keywords = KEYWORDS
 
     # Drop the "N°" column.
     if "N°" in df.columns:
         df = df.drop("N°", axis=1)
 
     # Create a helper numeric column for filtering and sorting.
-    df['valor_numeric'] = df["Valor Referencial / Valor Estimado"].apply(convert_to_float)
+    valor_numeric = parse_amounts(df["Valor Referencial / Valor Estimado"])
 
     # Filter the DataFrame:
-    mask = (df['valor_numeric'] > lower_bound) | (df['valor_numeric'].isna())
-    df_filtered = df[mask].copy()
+    mask = (valor_numeric > lower_bound) | (valor_numeric.isna())
+    df_filtered = df[mask].assign(valor_numeric=valor_numeric[mask])
 
     # Sort the filtered DataFrame in descending order using the numeric column.
     df_sorted = df_filtered.sort_values(by='valor_numeric', ascending=False, na_position='first')
@@ -377,9 +2080,12 @@ def filter_data_obras(df, lower_bound):
     # Optionally drop the helper column if no longer needed.
     df_sorted = df_sorted.drop('valor_numeric', axis=1)
 
-    dfs = {}
-    for keyword in KEYWORDS:
-        dfs[keyword] = df_sorted[df_sorted["Descripción de Objeto"].str.contains(keyword, case=False, na=False)]
+    # Every keyword sheet comes from the index lookups or one classification pass
+    if matches is not None:
+        dfs = {keyword: df_sorted[df_sorted["Nomenclatura"].isin(matches[keyword]).to_numpy()] for keyword in keywords}
+    else:
+        membership = KeywordMatcher(keywords).matrix(df_sorted["Descripción de Objeto"])
+        dfs = {keyword: df_sorted[membership[keyword].to_numpy()] for keyword in keywords}
     dfs = {MAIN_SHEET_NAME: df_sorted, **dfs}
 
     return dfs
@@ -388,175 +2094,493 @@ def filter_data_obras(df, lower_bound):
 # VIDRIOS
 #
 
-async def get_data_vidrios(browser, year, start_date, end_date, opts):
+async def get_data_vidrios(pool, year, start_date, end_date, opts):
     filtro = opts.get("filter")
     # Check if end_date is before start_date
     if end_date < start_date:
         raise ValueError("end_date cannot be before start_date")
 
-    # Format and print the dates
-    f_start_date = start_date.strftime("%d/%m/%Y")
-    f_end_date = end_date.strftime("%d/%m/%Y")
-
-    # Start page instance
-    context = await browser.new_context()
-    page = await context.new_page()
-
-    # Web scraping
-    await page.goto("https://prod2.seace.gob.pe/seacebus-uiwd-pub/buscadorPublico/buscadorPublico.xhtml")
-    await page.get_by_role("link", name="Buscador de Procedimientos de").click()
-    time.sleep(9)
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:anioConvocatoria_label\"]").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:anioConvocatoria_panel\"]").get_by_text(year).click()
-    await page.get_by_text("Búsqueda Avanzada").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dfechaInicio_input\"]").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dfechaInicio_input\"]").fill(f_start_date)
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dfechaFin_input\"]").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dfechaFin_input\"]").fill(f_end_date)
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:descripcionObjeto\"]").click()
-    await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:descripcionObjeto\"]").fill(filtro)
-    #await page.pause()
-    await page.get_by_role("button", name="Buscar").click()
-
-    # Wait for the filter
-    #await page.locator("[id=\"tbBuscador\\:idFormBuscarProceso\\:dtProcesos_data\"]").filter(has_not_text="No se encontraron Datos").click()
-    time.sleep(6)
-
-    # Download the results
-    async with page.expect_download() as download_info:
-        await page.get_by_role("button", name="Exportar a Excel").click()
-    download = await download_info.value
-    filepath = f"{TMP_DIR}/{uuid.uuid4()}.xls"
-    await download.save_as(filepath)
-
-    # Cleanup
-    await page.close()
-    await context.close()
-
-    df = pd.read_excel(filepath)
-    df = df[::-1].reset_index(drop=True)
+    async with pool.session("vidrios", year, opts.get("fresh", False)) as session:
+        body = await session.export(start_date, end_date, filtro)
+    if body is None:
+        return empty_result()
 
-    df = validate_dataframe_header(df, RENAME_MAP)
+    return await asyncio.to_thread(read_export, "vidrios", body)
 
-    return df
+async def query_vidrios_data(pool, year, current_date, planner, cache, get_data=None, journal=None, retrier=None):
+    # Raw date windows of every object type, the keyword sheet is answered by
+    # the harvest store's full-text index (HarvestStore.read(keywords=...))
+    get_data = get_data or get_data_vidrios
+    if retrier is not None:
+        get_data = retrier.wrap(get_data)
+    if journal is not None:
+        get_data = journal.wrap(get_data)
+    get_data = cache.wrap(get_data)
 
-async def query_vidrios_data(browser, year, current_date):
-    async def query_data_recursive(filter, start_date, end_date):
-        return await general_query_data_recursive(get_data_vidrios, browser, year, start_date, end_date, {"filter": filter})
+    async def query_data_recursive(start_date, end_date):
+        return await general_query_data_recursive(get_data, pool, year, start_date, end_date, {"mode": "vidrios"}, planner)
 
     given_year = int(year)
-    df_map = {}
 
     # Only proceed if given_year is less than or equal to current year
     if given_year > current_date.year:
         return pd.DataFrame()
 
-    global_results = []
-    for filter in KEYWORDS_VIDRIOS:
-        results = []
-
-        start_date_given = datetime.date(given_year, 1, 1)
-        end_date_given = current_date if given_year == current_date.year else datetime.date(given_year, 12, 31)
-        
-        cur_date = start_date_given
-        while cur_date <= end_date_given:
-            next_date = cur_date + datetime.timedelta(days=300)
-            if next_date > end_date_given:
-                next_date = end_date_given
-            df_part = await query_data_recursive(filter, cur_date, next_date)
-            results.append(df_part)
-            cur_date = next_date + datetime.timedelta(days=1)
-
-        # Combine all data into one DataFrame
-        df = pd.concat(results, ignore_index=True)[::-1].reset_index(drop=True)
-        global_results.append(df)
-    global_df = pd.concat(global_results, ignore_index=True)
+    start_date_given = datetime.date(given_year, 1, 1)
+    end_date_given = current_date if given_year == current_date.year else datetime.date(given_year, 12, 31)
+    key = density_key("vidrios", year)
+    windows = cache.plan(planner, key, start_date_given, end_date_given, 15)
+    if journal is not None:
+        journal.plan(key, windows)
+    accumulator = ChunkAccumulator()
+    accumulator.extend(await gather_windows(query_data_recursive, windows))
+
+    # Combine all data into one DataFrame
+    return accumulator.materialize()
 
-    # Drop the "N°" column.
-    if "N°" in global_df.columns:
-        global_df = global_df.drop("N°", axis=1)
+#
+# Pipeline
+#
 
-    df_map[MAIN_SHEET_NAME] = global_df
+def publish_workbook(df_map, filter_filepath, merge_index):
+    # A workbook whose rows did not change keeps its bytes, so it is not uploaded again
+    if prepare_data_for_excel(df_map, filter_filepath, merge_index) or not os.path.exists(filter_filepath):
+        data_to_excel(df_map, filter_filepath)
+        print(f"MAIN: published {filter_filepath}.")
+    else:
+        merge_index.skipped_workbooks += 1
+        print(f"MAIN: {filter_filepath} unchanged, not rewritten.")
+    merge_index.commit(filter_filepath)
+
+def publish_vidrios(store, merge_index, year, df, filter_filepath):
+    if df is not None:
+        store.write("vidrios", year, df)
+    df_map = {MAIN_SHEET_NAME: store.read("vidrios", year, keywords=KEYWORDS_VIDRIOS)}
+    publish_workbook(df_map, filter_filepath, merge_index)
+
+def publish_obras(store, merge_index, year, df, complete, filter_filepath, replace=True):
+    if df is not None:
+        store.write("obras", year, df, replace)
+        if complete:
+            store.mark_complete("obras", year)
+    df = store.read("obras", year, min_value=4000000)
+    df_map = filter_data_obras(df, 4000000, KEYWORDS, store.matches("obras", year, KEYWORDS))
+    publish_workbook(df_map, filter_filepath, merge_index)
+
+async def run_pipeline(jobs, depth=PIPELINE_DEPTH):
+    # The scraper produces publish jobs while a worker thread runs the CPU heavy
+    # store, filter and Excel steps of the previous ones. It runs at most `depth`
+    # jobs ahead of the publisher, then waits for it.
+    queue = asyncio.Queue(maxsize=depth)
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publish")
+
+    async def produce():
+        async for job in jobs:
+            await queue.put(job)
+        await queue.put(None)
+
+    async def publish():
+        while (job := await queue.get()) is not None:
+            await loop.run_in_executor(executor, job)
 
-    return df_map
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(produce())
+            tg.create_task(publish())
+    finally:
+        executor.shutdown(wait=True)
 
 #
-# Main
+# OneDrive mirror
 #
 
-async def main():
-    if not os.path.isdir(DATA_DIR):
-        raise FileNotFoundError(f"Directory {DATA_DIR} does not exist!")
+# DRIVE_DIR is kept between runs so the onedrive client only transfers what
+# changed. The manifest holds the digest of every exported file as of the last
+# sync, to skip the upload when nothing changed and to report the bytes moved.
+class DriveMirror:
+    def __init__(self, path, drive_dir=DRIVE_DIR, export_dir=EXPORT_DIR):
+        self.path = path
+        self.drive_dir = drive_dir
+        self.export_dir = export_dir
+        self.counts = {"downloaded": 0, "downloaded_bytes": 0, "uploaded": 0, "uploaded_bytes": 0}
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS drive_manifest ("
+                " name TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, synced_at TEXT)"
+            )
 
-    recreate_folder(TMP_DIR)
-    recreate_folder(DRIVE_DIR)
-    os.makedirs(QUERY_DIR, exist_ok=True)
-    os.makedirs(f"{DRIVE_DIR}/{EXPORT_DIR}", exist_ok=True)
+    def _connect(self):
+        return connect_db(self.path)
+
+    def _scan(self):
+        folder = f"{self.drive_dir}/{self.export_dir}"
+        return {
+            entry.name: (file_digest(entry.path), entry.stat().st_size)
+            for entry in os.scandir(folder)
+            if entry.is_file()
+        }
+
+    def _manifest(self):
+        with self._connect() as con:
+            return {name: (digest, size) for name, digest, size in con.execute("SELECT name, digest, size FROM drive_manifest")}
+
+    def _record(self, files):
+        synced_at = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._connect() as con:
+            con.execute("DELETE FROM drive_manifest")
+            con.executemany(
+                "INSERT INTO drive_manifest VALUES (?, ?, ?, ?)",
+                ((name, digest, size, synced_at) for name, (digest, size) in files.items()),
+            )
 
-    # Import data
-    if os.environ.get("INCREMENTAL") != "no":
+    def _sync(self, *args):
         result = subprocess.run([
             "onedrive",
             "--sync",
             "--syncdir",
-            DRIVE_DIR,
+            self.drive_dir,
             "--single-directory",
-            EXPORT_DIR,
-            "--download-only",
-            "--cleanup-local-files",
+            self.export_dir,
+            *args,
         ])
         if result.returncode != 0:
             sys.exit(result.returncode)
 
-    # Get date data
-    timezone = pytz.timezone('America/Lima')
-    now = datetime.datetime.now(timezone)
-    current_date = now.date()
+    @span("onedrive_download")
+    def download(self):
+        before = self._scan()
+        self._sync("--download-only", "--cleanup-local-files")
+        after = self._scan()
+        changed = {name: value for name, value in after.items() if before.get(name) != value}
+        self.counts["downloaded"] += len(changed)
+        self.counts["downloaded_bytes"] += sum(size for _, size in changed.values())
+        self._record(after)
+
+    @span("onedrive_upload")
+    def upload(self):
+        files = self._scan()
+        manifest = self._manifest()
+        changed = {name: value for name, value in files.items() if manifest.get(name) != value}
+        if not changed:
+            print("MAIN: drive: no workbook changed, upload skipped.")
+            return
+        print(f"MAIN: drive: uploading {', '.join(sorted(changed))}.")
+        self._sync("--upload-only", "--no-remote-delete")
+        self.counts["uploaded"] += len(changed)
+        self.counts["uploaded_bytes"] += sum(size for _, size in changed.values())
+        self._record(files)
+
+    def report(self):
+        print(
+            f"MAIN: drive: {self.counts['downloaded']} files ({self.counts['downloaded_bytes']} bytes) downloaded, "
+            f"{self.counts['uploaded']} files ({self.counts['uploaded_bytes']} bytes) uploaded"
+        )
 
-    async with async_playwright() as p:
-        if os.environ.get("ENV") == "dev":
-            browser = await p.chromium.launch(headless=False, args=['--ozone-platform=wayland'])
-        else:
-            browser = await p.chromium.launch(headless=True)
+#
+# Harvester
+#
+
+def lima_today():
+    return datetime.datetime.now(pytz.timezone('America/Lima')).date()
+
+def complete_export(path, year):
+    # Previous versions rewrote the current year's file on every run, so it
+    # holds the whole year only if it was last written after the year ended
+    if not os.path.exists(path):
+        return False
+    written = datetime.datetime.fromtimestamp(os.path.getmtime(path), pytz.timezone('America/Lima')).date()
+    return written > datetime.date(int(year), 12, 31)
+
+async def launch_browser(p):
+    lean = LeanBrowser()
+    if os.environ.get("ENV") == "dev":
+        browser = await p.chromium.launch(headless=False, args=['--ozone-platform=wayland', *lean.launch_args()])
+    else:
+        browser = await p.chromium.launch(headless=True, args=lean.launch_args())
+    return browser, lean
+
+# Browser pool, stores and fetch wrappers shared by a single run and the daemon
+class Harvester:
+    def __init__(self, p, browser, lean):
+        self.browser = browser
+        self.lean = lean
+        self.pool = ContextPool(browser, SCRAPE_CONCURRENCY, lean)
+        self.planner = WindowPlanner(DENSITY_FILE)
+        self.store = HarvestStore(DB_FILE)
+        self.merge_index = MergeIndex(DB_FILE)
+        self.retrier = WindowRetrier(concurrency=HTTP_CONCURRENCY if FETCH_ENGINE == "http" else SCRAPE_CONCURRENCY)
+        self.exporter = HttpExporter(p.request, HTTP_CONCURRENCY) if FETCH_ENGINE == "http" else None
+        self.get_data = self.exporter.get_data if self.exporter is not None else None
+        self.cache = None
+
+    def workbook(self, mode, year):
+        return f"{DRIVE_DIR}/{EXPORT_DIR}/SEACE_{mode.upper()}_{year}.xlsx"
+
+    async def current_year(self, year, df):
+        # The vidrios and obras rows of the raw harvest of every object type.
+        # Rows past the cap of a capped day are missing from it, so those days
+        # are asked for again with the Obra filter and once per vidrios keyword.
+        obras = df[(df['Objeto de Contratación'] == OBJECT_TYPES["obras"]).to_numpy()]
+        days = sorted(self.planner.capped.pop(density_key("vidrios", year), ()))
+        if not days:
+            return df, obras
+        print(f"MAIN: {year}: querying {len(days)} capped days again with the Obra filter and {len(KEYWORDS_VIDRIOS)} keywords.")
+        windows = [(day, day) for day in days]
+
+        def requery(get_data, opts):
+            get_data = self.retrier.wrap(get_data)
+
+            async def query_data_recursive(start_date, end_date):
+                return await general_query_data_recursive(get_data, self.pool, year, start_date, end_date, opts, self.planner)
+            return gather_windows(query_data_recursive, windows)
+
+        obras_accumulator, vidrios_accumulator = ChunkAccumulator(), ChunkAccumulator()
+        obras_accumulator.extend(await requery(self.get_data or get_data_obras, {"mode": "obras"}))
+        for keyword in KEYWORDS_VIDRIOS:
+            vidrios_accumulator.extend(await requery(self.get_data or get_data_vidrios, {"mode": "vidrios", "filter": keyword}))
+        # HarvestStore.write keeps one row per Nomenclatura
+        return (
+            pd.concat([df, vidrios_accumulator.materialize()], ignore_index=True),
+            pd.concat([obras, obras_accumulator.materialize()], ignore_index=True),
+        )
+
+    async def jobs(self, current_date, journal):
+        # Full run: the raw windows of the current year, which also give its
+        # obras, and three earlier years of obras
+        self.cache = WindowCache(DB_FILE, current_date, read=os.environ.get("INCREMENTAL") != "no")
+        pool, planner, cache, store, get_data, retrier = self.pool, self.planner, self.cache, self.store, self.get_data, self.retrier
 
         # Vidrio fetch
         year = str(current_date.year)
-        filter_filepath = f"{DRIVE_DIR}/{EXPORT_DIR}/SEACE_VIDRIOS_{year}.xlsx"
-        df_map = await query_vidrios_data(browser, year, current_date)
-        prepare_data_for_excel(df_map, filter_filepath)
-        data_to_excel(df_map, filter_filepath)
+        df = await query_vidrios_data(pool, year, current_date, planner, cache, get_data, journal, retrier)
+        df, obras = await self.current_year(year, df)
+        yield partial(publish_vidrios, store, self.merge_index, year, df, self.workbook("vidrios", year))
 
         # Obras fetch
         for year in [str(current_date.year - i) for i in range(4)]:
             print(f"MAIN: Starting data collection for year {year}.")
             export_filepath = f"{QUERY_DIR}/{year}.xlsx"
-            filter_filepath = f"{DRIVE_DIR}/{EXPORT_DIR}/SEACE_OBRAS_{year}.xlsx"
-            if os.path.exists(export_filepath) and year != str(current_date.year):
-                print(f"MAIN: {export_filepath} already exists, skipping query.")
-                df = pd.read_excel(export_filepath)
+            replace = True
+            if year == str(current_date.year):
+                df, complete = obras, False
+            elif not store.is_complete("obras", year) and complete_export(export_filepath, year):
+                # Import the Excel cache written by previous versions, the
+                # store may already hold newer rows of that year
+                print(f"MAIN: importing {export_filepath} into the harvest store.")
+                df = await asyncio.to_thread(pd.read_excel, export_filepath)
+                complete, replace = True, False
+            elif store.is_complete("obras", year):
+                print(f"MAIN: obras {year} already harvested, skipping query.")
+                df, complete = None, True
             else:
-                df = await query_obras_data(browser, year, current_date)
-                df.to_excel(export_filepath, index=False)
-            df_map = filter_data_obras(df, 4000000)
-            prepare_data_for_excel(df_map, filter_filepath)
-            data_to_excel(df_map, filter_filepath)
+                df = await query_obras_data(pool, year, current_date, planner, cache, get_data, journal, retrier)
+                complete = True
+            yield partial(publish_obras, store, self.merge_index, year, df, complete, self.workbook("obras", year), replace)
+
+    async def poll(self, current_date):
+        # Only the open days are fetched, that is where new tenders show up
+        year = str(current_date.year)
+        start_date = max(current_date - datetime.timedelta(days=RECHECK_DAYS), datetime.date(current_date.year, 1, 1))
+        get_data = self.retrier.wrap(self.get_data or get_data_vidrios)
+        accumulator = ChunkAccumulator()
+        accumulator.extend(await general_query_data_recursive(
+            get_data, self.pool, year, start_date, current_date, {"mode": "vidrios"}, self.planner,
+        ))
+        df, obras = await self.current_year(year, accumulator.materialize())
+        rows = await asyncio.to_thread(self.store.write, "vidrios", year, df)
+        rows += await asyncio.to_thread(self.store.write, "obras", year, obras)
+        print(f"MAIN: poll {start_date} {current_date}: {rows} rows stored.")
+        return rows
+
+    async def flush_jobs(self, current_date):
+        # Current year workbooks rebuilt from the store, unchanged ones are skipped
+        year = str(current_date.year)
+        yield partial(publish_vidrios, self.store, self.merge_index, year, None, self.workbook("vidrios", year))
+        yield partial(publish_obras, self.store, self.merge_index, year, None, False, self.workbook("obras", year))
+
+    async def close(self):
+        if self.exporter is not None:
+            await self.exporter.close()
+            self.exporter.report()
+        await self.pool.close()
+
+    def report(self):
+        print_step_latencies()
+        self.lean.report()
+        self.planner.report()
+        if self.cache is not None:
+            self.cache.report()
+        self.retrier.report()
+        self.merge_index.report()
+        self.planner.save()
+
+    def metrics(self):
+        # The counters behind the reports above, for RunReport
+        metrics = {
+            "planner": {"queries": self.planner.queries, "truncated": self.planner.truncated, "avoided": self.planner.avoided(), "capped_days": self.planner.capped_days},
+            "retries": dict(self.retrier.counts),
+            "merge": {**self.merge_index.counts, "skipped_workbooks": self.merge_index.skipped_workbooks},
+            "browser": {
+                **self.lean.counts,
+                "pages": self.lean.pages,
+                "requests": self.lean.requests,
+                "bytes": self.lean.transferred,
+            },
+        }
+        if self.cache is not None:
+            metrics["cache"] = {"hits": self.cache.hits, "misses": self.cache.misses}
+        if self.exporter is not None:
+            metrics["http"] = {"http_windows": self.exporter.http_windows, "browser_windows": self.exporter.browser_windows}
+        return metrics
+
+#
+# Main
+#
+
+def prepare_data_dir():
+    if not os.path.isdir(DATA_DIR):
+        raise FileNotFoundError(f"Directory {DATA_DIR} does not exist!")
+
+    # The mirror is kept between runs, only a non incremental run starts empty
+    if os.environ.get("INCREMENTAL") == "no":
+        recreate_folder(DRIVE_DIR)
+    os.makedirs(f"{DRIVE_DIR}/{EXPORT_DIR}", exist_ok=True)
+
+    # Export parsing (asyncio.to_thread) gets its own bounded pool
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse"))
+
+async def main():
+    prepare_data_dir()
+    run_report = RunReport()
+    mirror = DriveMirror(DB_FILE)
+
+    # Import data
+    if os.environ.get("INCREMENTAL") != "no":
+        mirror.download()
+
+    # Get date data
+    current_date = lima_today()
+
+    async with async_playwright() as p:
+        browser, lean = await launch_browser(p)
+        harvester = Harvester(p, browser, lean)
+        journal = RunJournal(DB_FILE, current_date)
+
+        await run_pipeline(harvester.jobs(current_date, journal))
+        journal.finish()
 
         # Cleanup
+        await harvester.close()
         await browser.close()
 
+    harvester.report()
+    journal.report()
+
     # Export data
-    result = subprocess.run([
-        "onedrive",
-        "--sync",
-        "--syncdir",
-        DRIVE_DIR,
-        "--single-directory",
-        EXPORT_DIR,
-        "--upload-only",
-        "--no-remote-delete",
-    ])
-    if result.returncode != 0:
-        sys.exit(result.returncode)
-
-asyncio.run(main())
+    mirror.upload()
+    mirror.report()
+
+    run_report.write({
+        **harvester.metrics(),
+        "journal": {"resumed": journal.resumed, "fetched": journal.fetched, "failed": journal.failed},
+        "drive": dict(mirror.counts),
+    })
+
+# Keeps the browser warm between cycles: polls the open days every
+# POLL_INTERVAL, flushes the current year workbooks every FLUSH_INTERVAL when
+# polls ran, and runs the full reconciliation every RECONCILE_INTERVAL
+async def daemon():
+    prepare_data_dir()
+    run_report = RunReport()
+    mirror = DriveMirror(DB_FILE)
+
+    async def sync(step):
+        # The onedrive client exits the process on failure, the daemon waits for the next cycle
+        try:
+            await asyncio.to_thread(step)
+            return True
+        except SystemExit as e:
+            print(f"MAIN: daemon: onedrive failed with {e.code}, retrying next cycle.")
+            return False
+
+    async with async_playwright() as p:
+        browser, lean = await launch_browser(p)
+        harvester = Harvester(p, browser, lean)
+        next_reconcile = next_poll = time.monotonic()
+        next_flush = None
+        failures = 0
+
+        def retry_at():
+            # Failed steps wait for the next poll, twice as long while they keep failing
+            nonlocal failures
+            failures += 1
+            return time.monotonic() + min(POLL_INTERVAL * 2 ** (failures - 1), RECONCILE_INTERVAL)
+
+        try:
+            while True:
+                now = time.monotonic()
+                current_date = lima_today()
+                if now >= next_reconcile:
+                    print(f"MAIN: daemon: full reconciliation for {current_date}.")
+                    try:
+                        if os.environ.get("INCREMENTAL") != "no":
+                            await sync(mirror.download)
+                        journal = RunJournal(DB_FILE, current_date)
+                        await run_pipeline(harvester.jobs(current_date, journal))
+                        journal.finish()
+                        journal.report()
+                        uploaded = await sync(mirror.upload)
+                        harvester.report()
+                        mirror.report()
+                        run_report.write({
+                            **harvester.metrics(),
+                            "journal": {"resumed": journal.resumed, "fetched": journal.fetched, "failed": journal.failed},
+                            "drive": dict(mirror.counts),
+                        })
+                        failures = 0
+                        done = time.monotonic()
+                        next_reconcile = done + RECONCILE_INTERVAL
+                        next_poll = done + POLL_INTERVAL
+                        # Workbooks the upload missed go out with the next flush
+                        next_flush = None if uploaded else next_poll
+                    except Exception as e:
+                        # The journal keeps the finished windows for the retry
+                        print(f"MAIN: daemon: reconciliation failed: {e!r}")
+                        next_reconcile = next_poll = retry_at()
+                elif now >= next_poll:
+                    try:
+                        await harvester.poll(current_date)
+                        if next_flush is None:
+                            next_flush = now + FLUSH_INTERVAL
+                    except Exception as e:
+                        print(f"MAIN: daemon: poll failed: {e!r}")
+                    next_poll = time.monotonic() + POLL_INTERVAL
+
+                if next_flush is not None and now >= next_flush:
+                    print("MAIN: daemon: flushing workbooks.")
+                    try:
+                        flushed = await sync(mirror.download)
+                        if flushed:
+                            await run_pipeline(harvester.flush_jobs(current_date))
+                            flushed = await sync(mirror.upload)
+                            mirror.report()
+                            run_report.write({**harvester.metrics(), "drive": dict(mirror.counts)})
+                    except Exception as e:
+                        print(f"MAIN: daemon: flush failed: {e!r}")
+                        flushed = False
+                    if flushed:
+                        failures = 0
+                        next_flush = None
+                    else:
+                        next_flush = retry_at()
+
+                wake = min(t for t in (next_reconcile, next_poll, next_flush) if t is not None)
+                await asyncio.sleep(max(0, wake - time.monotonic()))
+        finally:
+            await harvester.close()
+            await browser.close()
+
+if __name__ == "__main__":
+    asyncio.run(daemon() if os.environ.get("RUN_MODE") == "daemon" else main())
 